@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from aioredis import RedisError
+
+from app.lib.local_cache import LocalTTLCache
+from app.lib.redis import redis_async_client, redis_pubsub_client
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+TEST_SEARCH_KEY = 'test-search:{domain}:{test_id}'
+TEST_SEARCH_GENERATION_KEY = 'test-search-generation:{domain}:{test_id}'
+TEST_SEARCH_GENERATION_TTL = 60 * 60 * 24
+QUESTION_KEY = 'question:{domain}:{question_id}'
+INVALIDATION_CHANNEL = 'cache-invalidation'
+SUBSCRIBER_RECONNECT_DELAY = 5
+
+# Ответ кладётся в кэш, только если тест не инвалидировали после чтения поколения,
+# иначе запрос, прочитавший БД до сохранения теста, вернул бы в кэш устаревший ответ.
+# KEYS: пары (ключ ответа, ключ поколения), ARGV: TTL и пары (ответ, прочитанное поколение)
+SET_TEST_SEARCH_SCRIPT = '''
+for index = 1, #KEYS, 2 do
+    local generation = redis.call('GET', KEYS[index + 1]) or ''
+    if generation == ARGV[index + 2] then
+        redis.call('SET', KEYS[index], ARGV[index + 1], 'EX', tonumber(ARGV[1]))
+    end
+end
+return 1
+'''
+
+local_cache = LocalTTLCache(
+    maxsize=settings.LOCAL_CACHE_SIZE,
+    ttl=settings.LOCAL_CACHE_TTL,
+)
+
+# Отметка о вопросе без ответа: повторные запросы не идут в БД до истечения QUESTIONS_MISS_CACHE_TTL
+MISSING_ANSWER = object()
+
+TestKey = Tuple[str, int]
+
+
+@dataclass
+class TestSearchCacheVersion:
+    """Поколения тестов, прочитанные вместе с промахами кэша, и поколение локального кэша."""
+
+    local_generation: int
+    generations: Dict[TestKey, str] = field(default_factory=dict)
+
+
+def get_test_search_key(domain: str, test_id: int) -> str:
+    return TEST_SEARCH_KEY.format(domain=domain, test_id=test_id)
+
+
+def get_test_search_generation_key(domain: str, test_id: int) -> str:
+    return TEST_SEARCH_GENERATION_KEY.format(domain=domain, test_id=test_id)
+
+
+def get_question_key(domain: str, question_id: int) -> str:
+    return QUESTION_KEY.format(domain=domain, question_id=question_id)
+
+
+async def get_cached_test_search(domain: str, test_id: int) -> Tuple[Optional[bytes], TestSearchCacheVersion]:
+    """Возвращает кэшированный ответ и версию, с которой нужно сохранить ответ при промахе."""
+    cached, cache_version = await get_cached_tests_search([(domain, test_id)])
+    return cached.get((domain, test_id)), cache_version
+
+
+async def set_cached_test_search(
+    domain: str,
+    test_id: int,
+    content: bytes,
+    cache_version: TestSearchCacheVersion,
+) -> None:
+    await set_cached_tests_search({(domain, test_id): content}, cache_version)
+
+
+async def get_cached_tests_search(
+    tests_keys: List[TestKey],
+) -> Tuple[Dict[TestKey, bytes], TestSearchCacheVersion]:
+    """Промахи локального кэша читаются вместе с поколениями тестов одним MGET."""
+    cached: Dict[TestKey, bytes] = {}
+    cache_version = TestSearchCacheVersion(local_generation=local_cache.generation)
+    missed: List[TestKey] = []
+    for domain, test_id in tests_keys:
+        if (content := local_cache.get(get_test_search_key(domain, test_id))) is not None:
+            cached[(domain, test_id)] = content
+        else:
+            missed.append((domain, test_id))
+
+    if not missed:
+        return cached, cache_version
+
+    try:
+        async with redis_async_client() as redis_client:
+            values = await redis_client.mget(*(
+                key
+                for domain, test_id in missed
+                for key in (get_test_search_key(domain, test_id), get_test_search_generation_key(domain, test_id))
+            ))
+    except (RedisError, OSError):
+        logger.warning('Test search cache is unavailable', exc_info=True)
+        return cached, cache_version
+
+    for index, (domain, test_id) in enumerate(missed):
+        content, generation = values[index * 2], values[index * 2 + 1]
+        if content is not None:
+            local_cache.set(get_test_search_key(domain, test_id), content, cache_version.local_generation)
+            cached[(domain, test_id)] = content
+        else:
+            cache_version.generations[(domain, test_id)] = (generation or b'').decode()
+    return cached, cache_version
+
+
+async def set_cached_tests_search(
+    contents: Dict[TestKey, bytes],
+    cache_version: TestSearchCacheVersion,
+) -> None:
+    # Без прочитанного поколения нельзя проверить, что ответ не устарел
+    contents = {
+        test_key: content
+        for test_key, content in contents.items()
+        if test_key in cache_version.generations
+    }
+    if not contents:
+        return
+
+    for (domain, test_id), content in contents.items():
+        local_cache.set(get_test_search_key(domain, test_id), content, cache_version.local_generation)
+
+    keys: List[str] = []
+    args: List[Any] = [settings.SEARCH_CACHE_TTL]
+    for (domain, test_id), content in contents.items():
+        keys.extend((get_test_search_key(domain, test_id), get_test_search_generation_key(domain, test_id)))
+        args.extend((content, cache_version.generations[(domain, test_id)]))
+
+    try:
+        async with redis_async_client() as redis_client:
+            await redis_client.eval(SET_TEST_SEARCH_SCRIPT, keys=keys, args=args)
+    except (RedisError, OSError):
+        logger.warning('Test search cache is unavailable', exc_info=True)
+
+
+async def publish_invalidation(keys: Iterable[str]) -> None:
+    """Сбрасывает ключи в локальных кэшах всех процессов.
+
+    Вызывается после записи в БД, поэтому ошибки Redis только логируются:
+    остальные процессы увидят изменения по истечении LOCAL_CACHE_TTL.
+    """
+    keys = list(keys)
+    for key in keys:
+        local_cache.delete(key)
+
+    try:
+        async with redis_async_client() as redis_client:
+            await redis_client.publish(INVALIDATION_CHANNEL, json.dumps(keys))
+    except (RedisError, OSError):
+        logger.warning('Failed to publish cache invalidation of %d keys', len(keys), exc_info=True)
+
+
+async def invalidate_test_search(domain: str, test_id: int) -> None:
+    await invalidate_tests_search([(domain, test_id)])
+
+
+async def invalidate_tests_search(tests_keys: List[Tuple[str, int]]) -> None:
+    """Сбрасывает кэш тестов. Вызывается после записи в БД, поэтому ошибки Redis только логируются."""
+    if not tests_keys:
+        return
+
+    keys = [get_test_search_key(domain, test_id) for domain, test_id in tests_keys]
+    try:
+        async with redis_async_client() as redis_client:
+            transaction = redis_client.multi_exec()
+            for (domain, test_id), key in zip(tests_keys, keys):
+                generation_key = get_test_search_generation_key(domain, test_id)
+                transaction.incr(generation_key)
+                transaction.expire(generation_key, TEST_SEARCH_GENERATION_TTL)
+                transaction.delete(key)
+            await transaction.execute()
+    except (RedisError, OSError):
+        logger.warning('Failed to invalidate test search cache for %s', ', '.join(keys), exc_info=True)
+    await publish_invalidation(keys)
+
+
+async def invalidate_questions(domain: str, question_ids: Iterable[int]) -> None:
+    await publish_invalidation(
+        get_question_key(domain, question_id) for question_id in question_ids
+    )
+
+
+async def _listen_invalidations() -> None:
+    while True:
+        try:
+            async with redis_pubsub_client() as redis_client:
+                channel, = await redis_client.subscribe(INVALIDATION_CHANNEL)
+                # Сообщения, пропущенные во время переподключения, не восстановить
+                local_cache.clear()
+                async for message in channel.iter():
+                    for key in json.loads(message):
+                        local_cache.delete(key)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.warning('Cache invalidation subscriber disconnected', exc_info=True)
+            await asyncio.sleep(SUBSCRIBER_RECONNECT_DELAY)
+
+
+_subscriber_task: Optional[asyncio.Task] = None
+
+
+async def start_invalidation_subscriber() -> None:
+    global _subscriber_task
+
+    if _subscriber_task is None:
+        _subscriber_task = asyncio.ensure_future(_listen_invalidations())
+
+
+async def stop_invalidation_subscriber() -> None:
+    global _subscriber_task
+
+    if _subscriber_task is not None:
+        _subscriber_task.cancel()
+        try:
+            await _subscriber_task
+        except asyncio.CancelledError:
+            pass
+        _subscriber_task = None
+
+
+def get_local_cache_stats() -> Dict[str, Any]:
+    return local_cache.get_stats()
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from selectolax.parser import HTMLParser
+
+from app.applications.tests.dto import TestParseRequest
+from app.applications.tests.queries import get_questions_statuses
+from app.lib.redis import redis_async_client
+from app.parser.dto import CompletionStatus
+from app.parser.exceptions import ParseException
+from app.parser.helpers import is_question_status_improved
+from app.parser.logic import get_page_questions_statuses, request_test_page
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'coalesce:{domain}:{test_id}:pending'
+PROCESSING_KEY = 'coalesce:{domain}:{test_id}:processing'
+SCHEDULED_KEY = 'coalesce:{domain}:{test_id}:scheduled'
+LOCK_KEY = 'coalesce:{domain}:{test_id}:lock'
+# Запросы содержат cookie пользователя, поэтому хранятся не дольше нескольких окон
+PENDING_TTL_WINDOWS = 10
+
+# Список обработки может содержать запросы неподтверждённой задачи, поэтому
+# после постановки задач из него удаляются именно взятые элементы
+TAKE_PENDING_SCRIPT = '''
+local pending = redis.call('LRANGE', KEYS[1], 0, -1)
+for _, raw_request in ipairs(pending) do
+    redis.call('RPUSH', KEYS[2], raw_request)
+end
+redis.call('DEL', KEYS[1])
+redis.call('EXPIRE', KEYS[2], tonumber(ARGV[1]))
+return redis.call('LRANGE', KEYS[2], 0, -1)
+'''
+
+
+class CoalescingInProgress(Exception):
+    pass
+
+
+STATUS_RANK = {
+    CompletionStatus.NOT_ANSWERED: 0,
+    CompletionStatus.INCORRECT: 1,
+    CompletionStatus.PARTIALLY_CORRECT: 2,
+    CompletionStatus.CORRECT: 3,
+}
+
+
+def _get_pending_ttl() -> int:
+    return max(settings.PARSE_COALESCE_WINDOW * PENDING_TTL_WINDOWS, 60)
+
+
+async def add_pending_request(domain: str, test_id: int, parse_request: TestParseRequest) -> bool:
+    """Добавляет запрос в окно объединения.
+
+    Возвращает True, если окно только что открыто и нужно запланировать задачу объединения.
+    """
+    return await add_pending_requests(domain, test_id, [parse_request])
+
+
+async def add_pending_requests(domain: str, test_id: int, parse_requests: List[TestParseRequest]) -> bool:
+    pending_key = PENDING_KEY.format(domain=domain, test_id=test_id)
+    scheduled_key = SCHEDULED_KEY.format(domain=domain, test_id=test_id)
+
+    async with redis_async_client() as redis_client:
+        # Порядок важен: запросы попадают в список раньше, чем проверяется флаг окна
+        await redis_client.rpush(pending_key, *(parse_request.json() for parse_request in parse_requests))
+        await redis_client.expire(pending_key, _get_pending_ttl())
+        return bool(await redis_client.set(
+            scheduled_key,
+            '1',
+            expire=settings.PARSE_COALESCE_WINDOW * 10,
+            exist=redis_client.SET_IF_NOT_EXIST,
+        ))
+
+
+def get_coalesce_lock_id(domain: str, test_id: int) -> str:
+    return LOCK_KEY.format(domain=domain, test_id=test_id)
+
+
+async def take_pending_requests(domain: str, test_id: int) -> Tuple[List[TestParseRequest], List[bytes]]:
+    """Переносит запросы окна в список обработки и возвращает их вместе со взятыми элементами.
+
+    Запросы остаются в списке обработки до ack_pending_requests, поэтому при
+    ошибке повтор задачи получит их снова.
+    """
+    pending_key = PENDING_KEY.format(domain=domain, test_id=test_id)
+    processing_key = PROCESSING_KEY.format(domain=domain, test_id=test_id)
+    scheduled_key = SCHEDULED_KEY.format(domain=domain, test_id=test_id)
+
+    async with redis_async_client() as redis_client:
+        # Сначала закрываем окно: запросы, пришедшие после этого, откроют новое
+        await redis_client.delete(scheduled_key)
+        taken = await redis_client.eval(
+            TAKE_PENDING_SCRIPT,
+            keys=[pending_key, processing_key],
+            args=[_get_pending_ttl()],
+        )
+
+    requests: Dict[str, TestParseRequest] = {}
+    for raw_request in taken:
+        parse_request = TestParseRequest.parse_raw(raw_request)
+        requests[parse_request.attempt_url] = parse_request
+    return list(requests.values()), taken
+
+
+async def ack_pending_requests(domain: str, test_id: int, taken: List[bytes]) -> None:
+    if not taken:
+        return
+
+    processing_key = PROCESSING_KEY.format(domain=domain, test_id=test_id)
+    async with redis_async_client() as redis_client:
+        transaction = redis_client.multi_exec()
+        for raw_request in taken:
+            transaction.lrem(processing_key, 1, raw_request)
+        await transaction.execute()
+
+
+async def _fetch_attempt(
+    parse_request: TestParseRequest,
+) -> Optional[Tuple[str, Dict[int, CompletionStatus]]]:
+    try:
+        test_page = await request_test_page(parse_request.auth_cookie, parse_request.attempt_url)
+        return test_page, get_page_questions_statuses(HTMLParser(test_page))
+    except ParseException:
+        logger.warning('Не удалось предварительно загрузить попытку %s', parse_request.attempt_url)
+        return None
+
+
+def _is_gain(stored_status: Optional[CompletionStatus], status: CompletionStatus) -> bool:
+    if stored_status is None:
+        return True
+    return (
+        is_question_status_improved(stored_status, status)
+        and STATUS_RANK[status] > STATUS_RANK[CompletionStatus(stored_status)]
+    )
+
+
+def choose_attempts(
+    attempts_statuses: List[Dict[int, CompletionStatus]],
+    stored_statuses: Dict[int, CompletionStatus],
+) -> Set[int]:
+    """Жадно выбирает минимальный набор попыток, дающий лучший статус каждого вопроса."""
+    best_statuses: Dict[int, CompletionStatus] = {}
+    for statuses in attempts_statuses:
+        for question_id, status in statuses.items():
+            best = best_statuses.get(question_id)
+            if best is None or STATUS_RANK[status] > STATUS_RANK[best]:
+                best_statuses[question_id] = status
+
+    needed: Set[int] = {
+        question_id
+        for question_id, status in best_statuses.items()
+        if _is_gain(stored_statuses.get(question_id), status)
+    }
+
+    chosen: Set[int] = set()
+    while needed:
+        gains: List[Tuple[int, int]] = [
+            (
+                sum(1 for question_id in needed if statuses.get(question_id) == best_statuses[question_id]),
+                index,
+            )
+            for index, statuses in enumerate(attempts_statuses)
+            if index not in chosen
+        ]
+        if not gains:
+            break
+
+        gain, index = max(gains)
+        if gain == 0:
+            break
+
+        chosen.add(index)
+        needed = {
+            question_id for question_id in needed
+            if attempts_statuses[index].get(question_id) != best_statuses[question_id]
+        }
+
+    return chosen
+
+
+async def select_requests_to_parse(
+    domain: str,
+    parse_requests: List[TestParseRequest],
+) -> Tuple[List[Tuple[TestParseRequest, Optional[str]]], List[TestParseRequest]]:
+    """Разделяет запросы на требующие разбора и уже покрытые другими попытками.
+
+    Для запросов к разбору возвращается загруженная страница попытки, чтобы
+    разбор не запрашивал её повторно.
+    """
+    if len(parse_requests) <= 1:
+        return [(parse_request, None) for parse_request in parse_requests], []
+
+    fetched = await asyncio.gather(*(
+        _fetch_attempt(parse_request) for parse_request in parse_requests
+    ))
+
+    # Попытки, которые не удалось загрузить, обрабатываются как обычно, с повторами
+    to_parse: List[Tuple[TestParseRequest, Optional[str]]] = [
+        (parse_request, None)
+        for parse_request, attempt in zip(parse_requests, fetched)
+        if attempt is None
+    ]
+    fetched_requests = [
+        (parse_request, *attempt)
+        for parse_request, attempt in zip(parse_requests, fetched)
+        if attempt is not None
+    ]
+
+    attempts_statuses = [statuses for _, _, statuses in fetched_requests]
+    stored_statuses = await get_questions_statuses(domain, list({
+        question_id for statuses in attempts_statuses for question_id in statuses
+    }))
+    chosen = choose_attempts(attempts_statuses, stored_statuses)
+    satisfied: List[TestParseRequest] = []
+    for index, (parse_request, test_page, _) in enumerate(fetched_requests):
+        if index in chosen:
+            to_parse.append((parse_request, test_page))
+        else:
+            satisfied.append(parse_request)
+
+    return to_parse, satisfied
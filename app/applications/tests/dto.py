@@ -1,11 +1,73 @@
-from pydantic import BaseModel
+from typing import List, Literal, Optional
+
+from pydantic import BaseModel, conlist
+
+from app.parser.dto import CompletionStatus, ParseStage, ScreenshotFormat
+from app.settings.config import settings
 
 
 class TestParseRequest(BaseModel):
     auth_cookie: str
     attempt_url: str
+    backend: Optional[Literal['browser', 'html']] = None
+
+
+class TestBatchParseRequest(BaseModel):
+    requests: conlist(TestParseRequest, min_items=1, max_items=settings.PARSE_BATCH_MAX_SIZE)
+
+
+class TestBatchParseItem(BaseModel):
+    attempt_url: str
+    job_id: Optional[str] = None
+    duplicate: bool = False
+    error: Optional[str] = None
+
+
+class TestBatchParseResponse(BaseModel):
+    items: List[TestBatchParseItem]
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    stage: ParseStage
+    done: int = 0
+    total: int = 0
+    version: int = 0
+    updated_at: Optional[float] = None
+    error: Optional[str] = None
 
 
 class TestSearchRequest(BaseModel):
     domain: str
     test_id: int
+
+
+class TestBulkSearchRequest(BaseModel):
+    tests: conlist(TestSearchRequest, min_items=1, max_items=settings.SEARCH_BULK_MAX_SIZE)
+
+
+class StoredScreenshot(BaseModel):
+    url: str
+    hash: str
+    format: ScreenshotFormat = ScreenshotFormat.PNG
+
+
+class QuestionScreenshotRequest(BaseModel):
+    domain: str
+    question_id: int
+
+
+class QuestionAnswer(BaseModel):
+    question_id: int
+    status: CompletionStatus
+    screenshot: str
+    screenshot_format: ScreenshotFormat
+
+
+class QuestionsLookupRequest(BaseModel):
+    domain: str
+    question_ids: conlist(int, min_items=1, max_items=settings.QUESTIONS_LOOKUP_MAX_SIZE)
+
+
+class QuestionsLookupResponse(BaseModel):
+    questions: List[QuestionAnswer]
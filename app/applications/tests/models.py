@@ -1,9 +1,9 @@
-from tortoise import Tortoise, fields
+from tortoise import Tortoise, fields, models
 from tortoise.contrib.pydantic import pydantic_model_creator
 from tortoise.fields import SET_NULL
 
 from app.core.base.base_models import BaseDBModel
-from app.parser.dto import CompletionStatus
+from app.parser.dto import CompletionStatus, ScreenshotFormat
 
 
 class Test(BaseDBModel):
@@ -34,16 +34,31 @@ class Question(BaseDBModel):
     domain = fields.CharField(max_length=255)
     question_id = fields.IntField()
     screenshot = fields.CharField(max_length=256)
+    screenshot_hash = fields.CharField(max_length=32, null=True, index=True)
+    screenshot_format = fields.CharEnumField(ScreenshotFormat, default=ScreenshotFormat.PNG)
     status = fields.CharEnumField(CompletionStatus)
 
     class Meta:
         unique_together = ('question_id', 'domain')
-        indexes = ('question_id', 'domain')
+        # Покрывающий индекс для поиска ответов ("domain", "question_id") INCLUDE (...)
+        # создаётся миграцией 5: INCLUDE и CONCURRENTLY в описании модели не выразить
+        indexes = (('question_id', 'domain'),)
 
     def __str__(self) -> str:
         return f'[{self.status}] Question {self.question_id}'
 
 
+class ParseFence(models.Model):
+    """Последний fencing-токен, с которым записан результат задачи разбора."""
+
+    job_id = fields.CharField(max_length=255, pk=True)
+    token = fields.BigIntField()
+    updated_at = fields.DatetimeField(auto_now=True, index=True)
+
+    class Meta:
+        table = 'parse_fence'
+
+
 Tortoise.init_models(['app.applications.tests.models'], 'models')
 
 Test_Pydantic = pydantic_model_creator(Test)
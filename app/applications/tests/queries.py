@@ -0,0 +1,184 @@
+import uuid
+from typing import Dict, List, Set, Tuple
+
+from app.applications.tests.dto import StoredScreenshot
+from app.applications.tests.models import ParseFence, Question, Test
+from app.lib.celery_lock import FencingToken
+from app.parser.dto import CompletionStatus, ScreenshotFormat, TestInfoDTO
+
+# Статус вопроса меняется только в сторону улучшения, как в is_question_status_improved
+UPSERT_QUESTIONS_SQL = '''
+INSERT INTO "question" (
+    "id", "domain", "question_id", "screenshot", "screenshot_hash", "screenshot_format", "status"
+)
+SELECT v."id", $1, v."question_id", v."screenshot", v."screenshot_hash", v."screenshot_format", v."status"
+FROM unnest($2::uuid[], $3::int[], $4::varchar[], $5::varchar[], $6::varchar[], $7::varchar[])
+    AS v("id", "question_id", "screenshot", "screenshot_hash", "screenshot_format", "status")
+ON CONFLICT ("question_id", "domain") DO UPDATE
+SET "screenshot" = EXCLUDED."screenshot",
+    "screenshot_hash" = EXCLUDED."screenshot_hash",
+    "screenshot_format" = EXCLUDED."screenshot_format",
+    "status" = EXCLUDED."status",
+    "updated_at" = CURRENT_TIMESTAMP
+WHERE "question"."status" <> $8
+    AND ("question"."status" <> $9 OR EXCLUDED."status" = $8)
+'''
+
+# Попытки нового теста разбираются параллельно, поэтому тест создаёт первая из них,
+# а остальные ждут её транзакцию на уникальном индексе и используют созданную запись
+CREATE_TEST_SQL = '''
+INSERT INTO "test" ("id", "test_id", "domain", "name", "path")
+VALUES ($1, $2, $3, $4, $5)
+ON CONFLICT ("test_id", "domain") DO NOTHING
+'''
+
+LINK_QUESTIONS_SQL = '''
+INSERT INTO "question_tests" ("question_id", "test_id")
+SELECT q."id", $1
+FROM "question" q
+WHERE q."domain" = $2
+    AND q."question_id" = ANY($3::int[])
+    AND NOT EXISTS (
+        SELECT 1 FROM "question_tests" qt
+        WHERE qt."question_id" = q."id" AND qt."test_id" = $1
+    )
+'''
+
+# Запись проходит, только если токен новее уже записанного для этой задачи.
+# Ключ остаётся по задаче: разные попытки одного теста не должны отклонять друг друга.
+# Заодно удаляется порция записей старше $3 секунд, ведь устаревший владелец живёт не дольше
+# таймаута задачи. SKIP LOCKED не даёт параллельным сохранениям ждать друг друга
+CHECK_FENCE_SQL = '''
+WITH "pruned" AS (
+    DELETE FROM "parse_fence"
+    WHERE "job_id" IN (
+        SELECT "job_id" FROM "parse_fence"
+        WHERE "updated_at" < CURRENT_TIMESTAMP - make_interval(secs => $3) AND "job_id" <> $1
+        LIMIT 100
+        FOR UPDATE SKIP LOCKED
+    )
+)
+INSERT INTO "parse_fence" ("job_id", "token", "updated_at")
+VALUES ($1, $2, CURRENT_TIMESTAMP)
+ON CONFLICT ("job_id") DO UPDATE
+SET "token" = EXCLUDED."token",
+    "updated_at" = EXCLUDED."updated_at"
+WHERE "parse_fence"."token" <= EXCLUDED."token"
+RETURNING "token"
+'''
+
+LINKED_TESTS_SQL = '''
+SELECT DISTINCT t."domain", t."test_id"
+FROM "question" q
+JOIN "question_tests" qt ON qt."question_id" = q."id"
+JOIN "test" t ON t."id" = qt."test_id"
+WHERE q."domain" = $1
+    AND q."question_id" = ANY($2::int[])
+'''
+
+
+PARSE_FENCE_RETENTION = 60 * 60
+
+
+class StaleFencingToken(Exception):
+    pass
+
+
+async def check_fencing_token(fencing_token: FencingToken) -> None:
+    """Должна вызываться в той же транзакции, что и запись результата."""
+    rows = await ParseFence._meta.db.execute_query_dict(CHECK_FENCE_SQL, [
+        fencing_token.resource,
+        fencing_token.token,
+        PARSE_FENCE_RETENTION,
+    ])
+    if not rows:
+        raise StaleFencingToken(
+            f'Fencing token {fencing_token.token} for {fencing_token.resource} is outdated'
+        )
+
+
+UNSOLVED_TESTS_SQL = '''
+SELECT DISTINCT qt."test_id"
+FROM "question_tests" qt
+JOIN "question" q ON q."id" = qt."question_id"
+WHERE qt."test_id" = ANY($1::uuid[])
+    AND q."status" <> $2
+'''
+
+
+async def get_tests_with_unsolved_questions(test_ids: List[uuid.UUID]) -> Set[uuid.UUID]:
+    if not test_ids:
+        return set()
+
+    rows = await Question._meta.db.execute_query_dict(UNSOLVED_TESTS_SQL, [
+        test_ids,
+        CompletionStatus.CORRECT.value,
+    ])
+    return {row['test_id'] for row in rows}
+
+
+async def get_linked_tests_keys(domain: str, question_ids: List[int]) -> List[Tuple[str, int]]:
+    """Тесты, в ответы которых входят вопросы: вопрос домена общий для всех его тестов."""
+    if not question_ids:
+        return []
+
+    rows = await Question._meta.db.execute_query_dict(LINKED_TESTS_SQL, [domain, question_ids])
+    return [(row['domain'], row['test_id']) for row in rows]
+
+
+async def get_questions_statuses(domain: str, question_ids: List[int]) -> Dict[int, CompletionStatus]:
+    """Статусы вопросов домена: вопрос мог быть сохранён при разборе другого теста."""
+    if not question_ids:
+        return {}
+
+    return dict(await Question.filter(
+        domain=domain,
+        question_id__in=question_ids,
+    ).values_list('question_id', 'status'))
+
+
+async def bulk_upsert_questions(
+    domain: str,
+    questions_statuses: Dict[int, CompletionStatus],
+    screenshots: Dict[int, StoredScreenshot],
+) -> None:
+    question_ids = [
+        question_id for question_id in questions_statuses
+        if question_id in screenshots
+    ]
+    if not question_ids:
+        return
+
+    await Question._meta.db.execute_query(UPSERT_QUESTIONS_SQL, [
+        domain,
+        [uuid.uuid4() for _ in question_ids],
+        question_ids,
+        [screenshots[question_id].url for question_id in question_ids],
+        [screenshots[question_id].hash for question_id in question_ids],
+        [ScreenshotFormat(screenshots[question_id].format).value for question_id in question_ids],
+        [CompletionStatus(questions_statuses[question_id]).value for question_id in question_ids],
+        CompletionStatus.CORRECT.value,
+        CompletionStatus.PARTIALLY_CORRECT.value,
+    ])
+
+
+async def get_or_create_test(test_info: TestInfoDTO) -> Test:
+    await Test._meta.db.execute_query(CREATE_TEST_SQL, [
+        uuid.uuid4(),
+        test_info.id,
+        test_info.domain,
+        test_info.name,
+        '',
+    ])
+    return await Test.get(test_id=test_info.id, domain=test_info.domain)
+
+
+async def bulk_link_questions(test: Test, question_ids: List[int]) -> None:
+    if not question_ids:
+        return
+
+    await Question._meta.db.execute_query(LINK_QUESTIONS_SQL, [
+        test.id,
+        test.domain,
+        question_ids,
+    ])
@@ -0,0 +1,136 @@
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from kombu.exceptions import ChannelError
+from tortoise.query_utils import Q
+
+from app.applications.tests.models import Question, Test
+from app.applications.tests.queries import get_tests_with_unsolved_questions
+from app.lib.redis import redis_async_client, redis_sync_client
+from app.parser.dto import CompletionStatus, TestUrlInfoDTO
+from app.settings.config import settings
+
+PARSE_QUEUE_NEW = 'parse.new'
+PARSE_QUEUE_PARTIAL = 'parse.partial'
+PARSE_QUEUE_KNOWN = 'parse.known'
+
+# Порядок определяет приоритет для воркеров, слушающих несколько очередей
+PARSE_QUEUES = (PARSE_QUEUE_NEW, PARSE_QUEUE_PARTIAL, PARSE_QUEUE_KNOWN)
+
+QUEUE_LATENCY_KEY = 'queue-latency:{queue}'
+QUEUE_LATENCY_EWMA_WEIGHT = 0.2
+
+# Чтение и обновление EWMA выполняются атомарно, иначе воркеры затирают значения друг друга
+RECORD_LATENCY_SCRIPT = '''
+redis.replicate_commands()
+local latency = tonumber(ARGV[1])
+local weight = tonumber(ARGV[2])
+local ewma = tonumber(redis.call('HGET', KEYS[1], 'ewma'))
+if ewma == nil then
+    ewma = latency
+else
+    ewma = weight * latency + (1 - weight) * ewma
+end
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+redis.call('HSET', KEYS[1], 'last', tostring(latency), 'ewma', tostring(ewma), 'updated_at', tostring(now))
+return tostring(ewma)
+'''
+
+
+async def classify_parse_job(test_url_info: TestUrlInfoDTO) -> str:
+    test = await Test.get_or_none(
+        test_id=test_url_info.test_id,
+        domain=test_url_info.domain,
+    ).only('id')
+    if test is None:
+        return PARSE_QUEUE_NEW
+
+    has_unsolved_questions = await Question.filter(
+        tests=test.id,
+    ).exclude(
+        status=CompletionStatus.CORRECT,
+    ).exists()
+    return PARSE_QUEUE_PARTIAL if has_unsolved_questions else PARSE_QUEUE_KNOWN
+
+
+async def classify_parse_jobs(tests_url_info: Iterable[TestUrlInfoDTO]) -> Dict[Tuple[str, int], str]:
+    """Пакетный вариант classify_parse_job: два запроса к БД на любое число тестов."""
+    tests_keys = {(test_url_info.domain, test_url_info.test_id) for test_url_info in tests_url_info}
+    if not tests_keys:
+        return {}
+
+    tests = await Test.filter(
+        Q(*(Q(domain=domain, test_id=test_id) for domain, test_id in tests_keys), join_type=Q.OR),
+    ).values_list('id', 'domain', 'test_id')
+    tests_ids = {(domain, test_id): test_pk for test_pk, domain, test_id in tests}
+    unsolved_tests = await get_tests_with_unsolved_questions(list(tests_ids.values()))
+
+    queues: Dict[Tuple[str, int], str] = {}
+    for test_key in tests_keys:
+        test_pk = tests_ids.get(test_key)
+        if test_pk is None:
+            queues[test_key] = PARSE_QUEUE_NEW
+        elif test_pk in unsolved_tests:
+            queues[test_key] = PARSE_QUEUE_PARTIAL
+        else:
+            queues[test_key] = PARSE_QUEUE_KNOWN
+    return queues
+
+
+def record_queue_latency(queue: str, enqueued_at: Optional[float]) -> None:
+    if enqueued_at is None:
+        return
+
+    latency = max(time.time() - float(enqueued_at), 0.0)
+    with redis_sync_client() as redis_client:
+        redis_client.eval(
+            RECORD_LATENCY_SCRIPT,
+            1,
+            QUEUE_LATENCY_KEY.format(queue=queue),
+            latency,
+            QUEUE_LATENCY_EWMA_WEIGHT,
+        )
+
+
+def get_queues_depth() -> Dict[str, int]:
+    from app.core.celery_app import celery_app
+
+    queues_depth: Dict[str, int] = {}
+    with celery_app.connection_for_read() as connection:
+        for queue in PARSE_QUEUES:
+            # Пассивное объявление пустой или ещё не созданной очереди закрывает канал
+            # с ошибкой, поэтому каждая очередь проверяется в своём канале
+            try:
+                with connection.channel() as channel:
+                    queues_depth[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+            except ChannelError:
+                queues_depth[queue] = 0
+    return queues_depth
+
+
+async def get_queues_latency() -> Dict[str, Dict[str, float]]:
+    async with redis_async_client() as redis_client:
+        return {
+            queue: {
+                field.decode(): float(value)
+                for field, value in (await redis_client.hgetall(QUEUE_LATENCY_KEY.format(queue=queue))).items()
+            }
+            for queue in PARSE_QUEUES
+        }
+
+
+def get_queue_concurrency(queue: str) -> Optional[int]:
+    return settings.PARSE_QUEUES_CONCURRENCY.get(queue)
+
+
+async def get_queues_stats(queues_depth: Dict[str, int]) -> Dict[str, Any]:
+    queues_latency = await get_queues_latency()
+    return {
+        queue: {
+            'depth': queues_depth.get(queue, 0),
+            'latency': queues_latency.get(queue, {}),
+            'concurrency': get_queue_concurrency(queue),
+        }
+        for queue in PARSE_QUEUES
+    }
@@ -1,11 +1,29 @@
 import logging
+from typing import Optional
 
 from fastapi import APIRouter
 from starlette.background import BackgroundTasks
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response, StreamingResponse
 
-from app.applications.tests.dto import TestParseRequest, TestSearchRequest
-from app.applications.tests.models import Test, Test_Pydantic
-from app.applications.tests.services import enqueue_parse_task, search_test_by_request
+from app.applications.tests.cache import get_local_cache_stats
+from app.applications.tests.dto import (
+    JobStatus, QuestionAnswer, QuestionScreenshotRequest, QuestionsLookupRequest,
+    QuestionsLookupResponse, TestBatchParseRequest, TestBatchParseResponse,
+    TestBulkSearchRequest, TestParseRequest, TestSearchRequest,
+)
+from app.applications.tests.models import Question, Test, Test_Pydantic
+from app.applications.tests.queues import get_queues_depth, get_queues_stats
+from app.applications.tests.services import (
+    enqueue_parse_batch, enqueue_parse_task, enqueue_question_screenshot_render,
+    get_bulk_search_response, get_test_search_response, iter_job_status_events, remove_test,
+    search_question, search_questions, wait_job_status,
+)
+from app.core.exceptions import APIException
+from app.lib.progress import JobProgressUnavailable
+from app.lib.redis import get_redis_pools_stats
+from app.parser.dto import ScreenshotFormat
+from app.settings.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -21,14 +39,92 @@ async def parse_test(
     return {}
 
 
+@router.post('/batch', response_model=TestBatchParseResponse, status_code=202, tags=['tests'])
+async def parse_tests_batch(batch_request: TestBatchParseRequest):
+    items = await enqueue_parse_batch(batch_request)
+    return TestBatchParseResponse(items=items)
+
+
+@router.get('/jobs/{job_id}', response_model=JobStatus, status_code=200, tags=['tests'])
+async def job_status(job_id: str, wait: float = 0, version: Optional[int] = None):
+    try:
+        status = await wait_job_status(job_id, version, min(max(wait, 0), settings.JOB_LONG_POLL_TIMEOUT))
+    except JobProgressUnavailable:
+        raise APIException(error_code=503, status_code=503, message='Job progress is unavailable')
+    if status is None:
+        raise APIException(error_code=404, status_code=404, message='Job not found')
+    return status
+
+
+@router.get('/jobs/{job_id}/events', status_code=200, tags=['tests'])
+async def job_status_events(job_id: str):
+    return StreamingResponse(iter_job_status_events(job_id), media_type='text/event-stream')
+
+
 @router.post('/search', response_model=Test_Pydantic, status_code=200, tags=['tests'])
 async def search_test(search_request: TestSearchRequest):
-    test = await search_test_by_request(search_request)
-    return await Test_Pydantic.from_tortoise_orm(test)
+    content = await get_test_search_response(search_request)
+    return Response(content=content, media_type='application/json')
+
+
+@router.post('/search/bulk', status_code=200, tags=['tests'])
+async def search_tests_bulk(bulk_request: TestBulkSearchRequest):
+    content = await get_bulk_search_response(bulk_request)
+    return Response(content=content, media_type='application/json')
+
+
+@router.get(
+    '/questions/{domain}/{question_id}',
+    response_model=QuestionAnswer,
+    status_code=200,
+    tags=['tests'],
+)
+async def question_lookup(domain: str, question_id: int):
+    return await search_question(domain, question_id)
+
+
+@router.post(
+    '/questions/lookup',
+    response_model=QuestionsLookupResponse,
+    status_code=200,
+    tags=['tests'],
+)
+async def questions_lookup(lookup_request: QuestionsLookupRequest):
+    answers = await search_questions(lookup_request.domain, lookup_request.question_ids)
+    return QuestionsLookupResponse(questions=list(answers.values()))
+
+
+@router.post('/questions/screenshot', status_code=200, tags=['tests'])
+async def question_screenshot(screenshot_request: QuestionScreenshotRequest):
+    question = await Question.get(
+        domain=screenshot_request.domain,
+        question_id=screenshot_request.question_id,
+    )
+    if question.screenshot_format == ScreenshotFormat.HTML:
+        await enqueue_question_screenshot_render(question.domain, question.question_id)
+        return JSONResponse(content={'document': question.screenshot}, status_code=202)
+
+    return {'screenshot': question.screenshot}
+
+
+@router.get('/cache/stats', status_code=200, tags=['tests'])
+async def cache_stats():
+    return get_local_cache_stats()
+
+
+@router.get('/redis/stats', status_code=200, tags=['tests'])
+async def redis_stats():
+    return await get_redis_pools_stats()
+
+
+@router.get('/queues/stats', status_code=200, tags=['tests'])
+async def queues_stats():
+    queues_depth = await run_in_threadpool(get_queues_depth)
+    return await get_queues_stats(queues_depth)
 
 
 @router.delete('/{test_id}', status_code=204, tags=['tests'])
 async def delete_test(test_id: int):
     test = await Test.get(test_id=test_id)
-    await test.delete()
+    await remove_test(test)
     return None
@@ -1,132 +1,313 @@
+import asyncio
+import json
 import logging
-from contextvars import ContextVar
-from dataclasses import dataclass
-from io import BytesIO
-from typing import Any, List
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-from aiobotocore.client import AioBaseClient
 from pydantic import ValidationError
-from tortoise.query_utils import Prefetch
+from selectolax.parser import HTMLParser
+from tortoise.exceptions import DoesNotExist
+from tortoise.query_utils import Prefetch, Q
 from tortoise.transactions import atomic
 
-from app.applications.tests.dto import TestParseRequest, TestSearchRequest
-from app.applications.tests.models import Question, Test
-from app.lib.aws import get_s3_resource, upload_file_to_s3
-from app.parser.dto import CompletionStatus, QuestionDTO, TestResultDTO
+from app.applications.tests.cache import (
+    MISSING_ANSWER, get_cached_test_search, get_cached_tests_search, get_question_key, invalidate_questions,
+    invalidate_test_search, invalidate_tests_search, local_cache, set_cached_test_search, set_cached_tests_search,
+)
+from app.applications.tests.coalescing import (
+    CoalescingInProgress, ack_pending_requests, add_pending_request, add_pending_requests, get_coalesce_lock_id,
+    select_requests_to_parse, take_pending_requests,
+)
+from app.applications.tests.dto import (
+    JobStatus, QuestionAnswer, StoredScreenshot, TestBatchParseItem, TestBatchParseRequest, TestBulkSearchRequest,
+    TestParseRequest, TestSearchRequest,
+)
+from app.applications.tests.models import Question, Test, Test_Pydantic
+from app.applications.tests.queries import (
+    StaleFencingToken, bulk_link_questions, bulk_upsert_questions, check_fencing_token, get_linked_tests_keys,
+    get_or_create_test, get_questions_statuses,
+)
+from app.applications.tests.queues import classify_parse_job, classify_parse_jobs
+from app.applications.tests.uploads import (
+    ScreenshotUploadPipeline, get_screenshot_hash, upload_question_screenshot,
+)
+from app.lib.celery_lock import current_lock, redis_lock
+from app.lib.progress import (
+    JobProgress, JobProgressUnavailable, job_progress_context, read_job_progress, write_job_progress,
+    write_jobs_progress,
+)
+from app.parser.dto import (
+    CompletionStatus, ParseStage, ScreenshotFormat, TestInfoDTO, TestUrlInfoDTO,
+)
 from app.parser.exceptions import AllQuestionsExists, ParseException
 from app.parser.helpers import get_test_info_from_attempt_url
-from app.parser.logic import parse_test
+from app.parser.html_logic import parse_test_html
+from app.parser.logic import (
+    get_page_questions_statuses, get_test_name, parse_test, render_question_screenshot, request_test_page,
+)
+from app.settings.config import settings
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class S3Context:
-    resource: AioBaseClient
-    bucket: Any
+JOB_FINAL_STAGES = {ParseStage.SAVED, ParseStage.SKIPPED, ParseStage.SATISFIED, ParseStage.FAILED}
+JOB_EVENTS_KEEPALIVE = 15
 
+PARSER_BACKENDS = {
+    'browser': parse_test,
+    'html': parse_test_html,
+}
 
-s3_context: ContextVar[S3Context] = ContextVar('s3_context')
 
+async def save_test_questions(
+    test: Test,
+    questions_statuses: Dict[int, CompletionStatus],
+    screenshots: Dict[int, StoredScreenshot],
+    question_ids: List[int],
+) -> None:
+    if (lock := current_lock.get()) is not None:
+        if lock.lost:
+            raise StaleFencingToken(f'Lock for {lock.fencing_token.resource} was lost before saving')
+        await check_fencing_token(lock.fencing_token)
 
-async def upload_question_screenshot(question_dto: QuestionDTO) -> str:
-    s3_ctx = s3_context.get()
-    bucket = s3_ctx.bucket
+    await bulk_upsert_questions(test.domain, questions_statuses, screenshots)
+    # Связываются все вопросы страницы, в том числе сохранённые при разборе других тестов
+    await bulk_link_questions(test, question_ids)
 
-    screenshot_file = BytesIO(question_dto.screenshot)
-    screenshot_name = f'{question_dto.domain}/{question_dto.id}.png'
-    return await upload_file_to_s3(bucket, screenshot_file, screenshot_name)
 
+@atomic()
+async def save_new_test(
+    test_info: TestInfoDTO,
+    questions_statuses: Dict[int, CompletionStatus],
+    screenshots: Dict[int, StoredScreenshot],
+    question_ids: List[int],
+):
+    test = await get_or_create_test(test_info)
+    await save_test_questions(test, questions_statuses, screenshots, question_ids)
 
-async def create_new_question(test: Test, question_dto: QuestionDTO, ) -> None:
-    await Question.create(
-        test=test,
-        question_id=question_dto.id,
-        screenshot=await upload_question_screenshot(question_dto),
-        status=question_dto.status,
-    )
 
+@atomic()
+async def update_existing_test(
+    test: Test,
+    questions_statuses: Dict[int, CompletionStatus],
+    screenshots: Dict[int, StoredScreenshot],
+    question_ids: List[int],
+):
+    await save_test_questions(test, questions_statuses, screenshots, question_ids)
 
-async def update_question(question: Question, question_dto: QuestionDTO) -> None:
-    old_status = question.status
-    new_status = question_dto.status
 
-    if old_status == CompletionStatus.CORRECT:
-        return
-
-    if old_status == CompletionStatus.PARTIALLY_CORRECT and new_status != CompletionStatus.CORRECT:
-        return
+def get_parse_job_id(test_url_info: TestUrlInfoDTO) -> str:
+    return '{domain}-{test_id}-{attempt_id}'.format(
+        domain=test_url_info.domain,
+        test_id=test_url_info.test_id,
+        attempt_id=test_url_info.attempt_id,
+    )
 
-    question.screenshot = await upload_question_screenshot(question_dto)
-    question.status = question_dto.status
-    await question.save()
 
+async def apply_parse_task(parse_request: TestParseRequest, test_page: Optional[str] = None) -> None:
+    from app.applications.tests.tasks import parse_quiz_task
 
-@atomic()
-async def save_new_test(test_result: TestResultDTO):
-    test_info = test_result.info
-    test = await Test.create(
-        test_id=test_info.id,
-        path='',
-        name=test_info.name,
-        domain=test_info.domain,
+    test_url_info = get_test_info_from_attempt_url(parse_request.attempt_url)
+    job_id = get_parse_job_id(test_url_info)
+    await write_job_progress(job_id, {'stage': ParseStage.QUEUED})
+    parse_quiz_task.apply_async(
+        (parse_request, test_page),
+        task_id=job_id,
+        queue=await classify_parse_job(test_url_info),
+        headers={'enqueued_at': time.time()},
     )
 
-    for question_dto in test_result.questions:
-        await create_new_question(test, question_dto)
 
+async def enqueue_parse_task(parse_request: TestParseRequest) -> None:
+    from app.applications.tests.tasks import parse_coalesced_task
 
-@atomic()
-async def update_existing_test(test: Test, test_result: TestResultDTO):
-    existing_questions = {
-        question.question_id: question
-        async for question in test.questions
-    }
+    if not settings.PARSE_COALESCE_WINDOW:
+        await apply_parse_task(parse_request)
+        return
 
-    for question_dto in test_result.questions:
-        if existing_question := existing_questions.get(question_dto.id):
-            await update_question(existing_question, question_dto)
-        else:
-            await create_new_question(test, question_dto)
+    test_url_info = get_test_info_from_attempt_url(parse_request.attempt_url)
+    domain, test_id = test_url_info.domain, test_url_info.test_id
+    await write_job_progress(get_parse_job_id(test_url_info), {'stage': ParseStage.QUEUED})
+    if await add_pending_request(domain, test_id, parse_request):
+        parse_coalesced_task.apply_async(
+            (domain, test_id),
+            countdown=settings.PARSE_COALESCE_WINDOW,
+            queue=await classify_parse_job(test_url_info),
+            headers={'enqueued_at': time.time()},
+        )
 
 
-async def enqueue_parse_task(parse_request: TestParseRequest) -> None:
+def publish_parse_tasks(jobs: List[Tuple[str, TestParseRequest, str]]) -> None:
     from app.applications.tests.tasks import parse_quiz_task
 
-    test_url_info = get_test_info_from_attempt_url(parse_request.attempt_url)
-    job_id = '{domain}-{test_id}-{attempt_id}'.format(
-        domain=test_url_info.domain,
-        test_id=test_url_info.test_id,
-        attempt_id=test_url_info.attempt_id,
-    )
-
-    parse_quiz_task.apply_async((parse_request,), task_id=job_id)
+    enqueued_at = time.time()
+    # Все задачи публикуются через одно соединение с брокером
+    with parse_quiz_task.app.producer_or_acquire() as producer:
+        for job_id, parse_request, queue in jobs:
+            parse_quiz_task.apply_async(
+                (parse_request,),
+                task_id=job_id,
+                queue=queue,
+                headers={'enqueued_at': enqueued_at},
+                producer=producer,
+            )
+
+
+def publish_coalesced_tasks(tests: List[Tuple[str, int, str]]) -> None:
+    from app.applications.tests.tasks import parse_coalesced_task
+
+    enqueued_at = time.time()
+    with parse_coalesced_task.app.producer_or_acquire() as producer:
+        for domain, test_id, queue in tests:
+            parse_coalesced_task.apply_async(
+                (domain, test_id),
+                countdown=settings.PARSE_COALESCE_WINDOW,
+                queue=queue,
+                headers={'enqueued_at': enqueued_at},
+                producer=producer,
+            )
+
+
+async def enqueue_parse_batch(batch_request: TestBatchParseRequest) -> List[TestBatchParseItem]:
+    items: List[TestBatchParseItem] = []
+    jobs: Dict[str, Tuple[TestParseRequest, TestUrlInfoDTO]] = {}
+    for parse_request in batch_request.requests:
+        try:
+            test_url_info = get_test_info_from_attempt_url(parse_request.attempt_url)
+        except ParseException as exc:
+            items.append(TestBatchParseItem(attempt_url=parse_request.attempt_url, error=str(exc)))
+            continue
+
+        job_id = get_parse_job_id(test_url_info)
+        items.append(TestBatchParseItem(
+            attempt_url=parse_request.attempt_url,
+            job_id=job_id,
+            duplicate=job_id in jobs,
+        ))
+        jobs.setdefault(job_id, (parse_request, test_url_info))
+
+    queues = await classify_parse_jobs(test_url_info for _, test_url_info in jobs.values())
+    await write_jobs_progress(jobs, {'stage': ParseStage.QUEUED})
+    loop = asyncio.get_event_loop()
+    if not settings.PARSE_COALESCE_WINDOW:
+        await loop.run_in_executor(None, publish_parse_tasks, [
+            (job_id, parse_request, queues[(test_url_info.domain, test_url_info.test_id)])
+            for job_id, (parse_request, test_url_info) in jobs.items()
+        ])
+        return items
+
+    # Попытки одного теста объединяются так же, как одиночные запросы
+    tests_requests: Dict[Tuple[str, int], List[TestParseRequest]] = {}
+    for parse_request, test_url_info in jobs.values():
+        tests_requests.setdefault((test_url_info.domain, test_url_info.test_id), []).append(parse_request)
+
+    scheduled_tests: List[Tuple[str, int, str]] = []
+    for (domain, test_id), parse_requests in tests_requests.items():
+        if await add_pending_requests(domain, test_id, parse_requests):
+            scheduled_tests.append((domain, test_id, queues[(domain, test_id)]))
+    await loop.run_in_executor(None, publish_coalesced_tasks, scheduled_tests)
+    return items
+
+
+async def parse_coalesced_requests(domain: str, test_id: int) -> None:
+    """Ставит в очередь выбранные попытки окна объединения.
+
+    Списки окна общие для всех задач теста, поэтому их обрабатывает одна задача,
+    а остальные повторяются через окно.
+    """
+    lock_id = get_coalesce_lock_id(domain, test_id)
+    async with redis_lock(lock_id, resource=lock_id) as lock:
+        if not lock.acquired:
+            raise CoalescingInProgress(f'Requests of test {test_id} for {domain} are already coalescing')
+        await _parse_coalesced_requests(domain, test_id)
+
+
+async def _parse_coalesced_requests(domain: str, test_id: int) -> None:
+    parse_requests, taken = await take_pending_requests(domain, test_id)
+    if not parse_requests:
+        return
 
+    to_parse, satisfied = await select_requests_to_parse(domain, parse_requests)
+    logger.info('[%s] Тест %d: объединено %d попыток, к разбору %d',
+                domain, test_id, len(parse_requests), len(to_parse))
+
+    # Вопросы этих попыток уже есть в выбранных, поэтому они завершаются без разбора
+    await write_jobs_progress(
+        (
+            get_parse_job_id(get_test_info_from_attempt_url(parse_request.attempt_url))
+            for parse_request in satisfied
+        ),
+        {'stage': ParseStage.SATISFIED},
+    )
+    for parse_request, test_page in to_parse:
+        await apply_parse_task(parse_request, test_page)
+    await ack_pending_requests(domain, test_id, taken)
 
-async def get_test_existing_questions_ids(test: Test) -> List[int]:
-    return await Question.filter(
-        tests=test.id,
-        status=CompletionStatus.CORRECT,
-    ).values_list('question_id', flat=True)
 
+async def parse_test_into_db(
+    parse_request: TestParseRequest,
+    test_page: Optional[str] = None,
+    final_attempt: bool = True,
+) -> None:
+    """Разбирает попытку и сохраняет вопросы.
 
-async def parse_test_into_db(parse_request: TestParseRequest) -> None:
+    ParseException повторяется задачей, поэтому до последней попытки задача
+    остаётся в незавершённом статусе RETRYING.
+    """
     test_url_info = get_test_info_from_attempt_url(parse_request.attempt_url)
+    with job_progress_context(get_parse_job_id(test_url_info)) as progress:
+        try:
+            await _parse_test_into_db(parse_request, test_url_info, progress, test_page)
+        except ParseException as exc:
+            stage = ParseStage.FAILED if final_attempt else ParseStage.RETRYING
+            await progress.set_stage(stage, error=str(exc) or type(exc).__name__)
+            raise
+        except Exception as exc:
+            await progress.set_stage(ParseStage.FAILED, error=str(exc) or type(exc).__name__)
+            raise
+        except asyncio.CancelledError:
+            # Отмена по PARSE_TIMEOUT не повторяется, иначе задача навсегда осталась бы в текущем этапе
+            await progress.set_stage(ParseStage.FAILED, error='Parse timed out')
+            raise
+
+
+async def _parse_test_into_db(
+    parse_request: TestParseRequest,
+    test_url_info: TestUrlInfoDTO,
+    progress: JobProgress,
+    test_page: Optional[str] = None,
+) -> None:
+    await progress.set_stage(ParseStage.FETCHING)
     existing_test = await Test.get_or_none(
         test_id=test_url_info.test_id,
         domain=test_url_info.domain,
     )
 
-    existing_test_questions = []
-    if existing_test:
-        existing_test_questions = get_test_existing_questions_ids(existing_test)
-
     try:
-        test_result = await parse_test(
-            cookie=parse_request.auth_cookie,
-            test_attempt_url=parse_request.attempt_url,
-            existing_test_questions=existing_test_questions,
+        if test_page is None:
+            test_page = await request_test_page(parse_request.auth_cookie, parse_request.attempt_url)
+        # Новый тест может состоять из вопросов, уже сохранённых из других тестов домена
+        tree = HTMLParser(test_page)
+        page_questions = get_page_questions_statuses(tree)
+        existing_questions_statuses = await get_questions_statuses(test_url_info.domain, list(page_questions))
+
+        pipeline = ScreenshotUploadPipeline(
+            test_url_info.domain,
+            existing_statuses=existing_questions_statuses,
+            queue_size=settings.SCREENSHOT_PIPELINE_QUEUE_SIZE,
+            workers=settings.S3_UPLOAD_CONCURRENCY,
         )
+        parse = PARSER_BACKENDS[parse_request.backend or settings.PARSER_BACKEND]
+        # Скриншоты загружаются в S3 параллельно с разбором страницы
+        async with pipeline:
+            test_result = await parse(
+                cookie=parse_request.auth_cookie,
+                test_attempt_url=parse_request.attempt_url,
+                existing_questions=existing_questions_statuses,
+                on_question=pipeline.put,
+                test_page=test_page,
+            )
+            await progress.set_stage(ParseStage.UPLOADING)
     except ParseException:
         logger.exception('[%s] Ошибка парсинга попытки %d теста %d',
                          test_url_info.domain,
@@ -144,19 +325,92 @@ async def parse_test_into_db(parse_request: TestParseRequest) -> None:
                     test_url_info.domain,
                     test_url_info.attempt_id,
                     test_url_info.test_id)
+        # Вопросы могли быть сохранены из других тестов, поэтому тест всё равно создаётся и связывается с ними
+        test_info = TestInfoDTO(
+            id=test_url_info.test_id,
+            name=get_test_name(tree),
+            path='',
+            domain=test_url_info.domain,
+        )
+        await _save_test(existing_test, test_info, {}, {}, list(page_questions))
+        await invalidate_test_search(test_url_info.domain, test_url_info.test_id)
+        await progress.set_stage(ParseStage.SKIPPED)
         return
 
-    async with get_s3_resource() as s3_res:
-        bucket = await s3_res.Bucket('questions')
-        ctx = S3Context(s3_res, bucket)
-        ctx_token = s3_context.set(ctx)
-
-        if existing_test:
-            await update_existing_test(existing_test, test_result)
-        else:
-            await save_new_test(test_result)
-
-        s3_context.reset(ctx_token)
+    await _save_test(
+        existing_test,
+        test_result.info,
+        pipeline.questions_statuses,
+        pipeline.screenshots,
+        list(page_questions),
+    )
+    saved_question_ids = list(pipeline.questions_statuses)
+    # Обновлённые вопросы входят и в ответы других тестов домена
+    linked_tests_keys = await get_linked_tests_keys(test_url_info.domain, saved_question_ids)
+    await invalidate_tests_search(list(dict.fromkeys([
+        (test_url_info.domain, test_url_info.test_id),
+        *linked_tests_keys,
+    ])))
+    await invalidate_questions(test_url_info.domain, saved_question_ids)
+    await progress.set_stage(ParseStage.SAVED)
+
+
+async def _save_test(
+    existing_test: Optional[Test],
+    test_info: TestInfoDTO,
+    questions_statuses: Dict[int, CompletionStatus],
+    screenshots: Dict[int, StoredScreenshot],
+    question_ids: List[int],
+) -> None:
+    if existing_test:
+        await update_existing_test(existing_test, questions_statuses, screenshots, question_ids)
+    else:
+        await save_new_test(test_info, questions_statuses, screenshots, question_ids)
+
+
+async def get_job_status(job_id: str) -> Optional[JobStatus]:
+    progress = await read_job_progress(job_id)
+    if progress is None:
+        return None
+    return JobStatus(job_id=job_id, **progress)
+
+
+async def wait_job_status(job_id: str, version: Optional[int], timeout: float) -> Optional[JobStatus]:
+    """Ждёт версию прогресса новее version, но не дольше timeout.
+
+    Прогресс хранится в Redis, поэтому ожидающие клиенты не нагружают БД.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        status = await get_job_status(job_id)
+        if status is not None and (
+            version is None or status.version > version or status.stage in JOB_FINAL_STAGES
+        ):
+            return status
+        if time.monotonic() >= deadline:
+            return status
+        await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+
+
+async def iter_job_status_events(job_id: str) -> AsyncIterator[bytes]:
+    version = -1
+    deadline = time.monotonic() + settings.JOB_EVENTS_TIMEOUT
+    while (remaining := deadline - time.monotonic()) > 0:
+        try:
+            status = await wait_job_status(job_id, version, min(JOB_EVENTS_KEEPALIVE, remaining))
+        except JobProgressUnavailable:
+            # Заголовки уже отправлены, поэтому клиент просто ждёт восстановления Redis
+            yield b': keepalive\n\n'
+            await asyncio.sleep(settings.JOB_POLL_INTERVAL)
+            continue
+        if status is None or status.version <= version:
+            yield b': keepalive\n\n'
+            continue
+
+        version = status.version
+        yield f'data: {status.json()}\n\n'.encode()
+        if status.stage in JOB_FINAL_STAGES:
+            return
 
 
 async def search_test_by_request(search_request: TestSearchRequest) -> Test:
@@ -168,9 +422,133 @@ async def search_test_by_request(search_request: TestSearchRequest) -> Test:
     )
 
 
-async def search_question(domain: str, question_id: int) -> Question:
-    return await Question.get(
+async def get_test_search_response(search_request: TestSearchRequest) -> bytes:
+    domain, test_id = search_request.domain, search_request.test_id
+
+    content, cache_version = await get_cached_test_search(domain, test_id)
+    if content is not None:
+        return content
+
+    test = await search_test_by_request(search_request)
+    # Вопросы уже загружены prefetch, from_tortoise_orm загрузил бы их повторно
+    content = Test_Pydantic.from_orm(test).json().encode()
+
+    await set_cached_test_search(domain, test_id, content, cache_version)
+    return content
+
+
+async def search_tests(tests_keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Test]:
+    """Загружает тесты с вопросами за два запроса независимо от их числа."""
+    if not tests_keys:
+        return {}
+
+    tests = await Test.filter(
+        Q(*(Q(domain=domain, test_id=test_id) for domain, test_id in tests_keys), join_type=Q.OR),
+    ).prefetch_related(
+        Prefetch('questions', queryset=Question.all().order_by('question_id')),
+    )
+    return {(test.domain, test.test_id): test for test in tests}
+
+
+async def get_bulk_search_response(bulk_request: TestBulkSearchRequest) -> bytes:
+    tests_keys = list(dict.fromkeys(
+        (search_request.domain, search_request.test_id) for search_request in bulk_request.tests
+    ))
+
+    contents, cache_version = await get_cached_tests_search(tests_keys)
+    tests = await search_tests([test_key for test_key in tests_keys if test_key not in contents])
+
+    new_contents = {
+        test_key: Test_Pydantic.from_orm(test).json().encode()
+        for test_key, test in tests.items()
+    }
+    await set_cached_tests_search(new_contents, cache_version)
+    contents.update(new_contents)
+
+    # Кэшированные ответы вставляются как есть, без повторной сериализации
+    return b'[' + b','.join(
+        b''.join((
+            f'{{"domain": {json.dumps(domain)}, "test_id": {test_id}, "test": '.encode(),
+            contents.get((domain, test_id), b'null'),
+            b'}',
+        ))
+        for domain, test_id in tests_keys
+    ) + b']'
+
+
+async def remove_test(test: Test) -> None:
+    await test.delete()
+    await invalidate_test_search(test.domain, test.test_id)
+
+
+async def search_questions(domain: str, question_ids: List[int]) -> Dict[int, QuestionAnswer]:
+    """Ищет решённые вопросы, не попавшие в локальный кэш, одним запросом.
+
+    Выбираются только колонки покрывающего индекса, поэтому запрос не читает таблицу.
+    """
+    answers: Dict[int, QuestionAnswer] = {}
+    missed: List[int] = []
+    for question_id in dict.fromkeys(question_ids):
+        if (answer := local_cache.get(get_question_key(domain, question_id))) is None:
+            missed.append(question_id)
+        elif answer is not MISSING_ANSWER:
+            answers[question_id] = answer
+
+    if not missed:
+        return answers
+
+    local_generation = local_cache.generation
+    rows = await Question.filter(
         domain=domain,
-        question_id=question_id,
+        question_id__in=missed,
         status__in=[CompletionStatus.CORRECT, CompletionStatus.PARTIALLY_CORRECT],
+    ).values('question_id', 'status', 'screenshot', 'screenshot_format')
+    for row in rows:
+        answer = QuestionAnswer(**row)
+        local_cache.set(get_question_key(domain, answer.question_id), answer, local_generation)
+        answers[answer.question_id] = answer
+
+    # Промахи кэшируются коротко: клиенты опрашивают ещё не решённые вопросы
+    for question_id in missed:
+        if question_id not in answers:
+            local_cache.set(
+                get_question_key(domain, question_id),
+                MISSING_ANSWER,
+                local_generation,
+                ttl=settings.QUESTIONS_MISS_CACHE_TTL,
+            )
+    return answers
+
+
+async def search_question(domain: str, question_id: int) -> QuestionAnswer:
+    answers = await search_questions(domain, [question_id])
+    if question_id not in answers:
+        raise DoesNotExist(f'Question {question_id} for {domain} not found')
+    return answers[question_id]
+
+
+async def enqueue_question_screenshot_render(domain: str, question_id: int) -> None:
+    from app.applications.tests.tasks import render_question_screenshot_task
+
+    render_question_screenshot_task.apply_async(
+        (domain, question_id),
+        task_id=f'{domain}-{question_id}-render',
+    )
+
+
+async def render_stored_question_screenshot(domain: str, question_id: int) -> None:
+    question = await Question.get(domain=domain, question_id=question_id)
+    if question.screenshot_format != ScreenshotFormat.HTML:
+        return
+
+    screenshot = await render_question_screenshot(question.screenshot)
+    screenshot_hash = get_screenshot_hash(screenshot)
+    stored_screenshot = await upload_question_screenshot(domain, screenshot_hash, screenshot)
+
+    await Question.filter(id=question.id, screenshot_hash=question.screenshot_hash).update(
+        screenshot=stored_screenshot.url,
+        screenshot_hash=screenshot_hash,
+        screenshot_format=stored_screenshot.format,
     )
+    await invalidate_questions(domain, [question_id])
+    await invalidate_tests_search(await get_linked_tests_keys(domain, [question_id]))
@@ -1,15 +1,49 @@
-import asyncio
+from typing import Any, Coroutine, Optional
 
 from celery.utils.log import get_task_logger
 
 from app.applications.tests.dto import TestParseRequest
-from app.applications.tests.services import parse_test_into_db
+from app.applications.tests.queries import StaleFencingToken
+from app.applications.tests.services import (
+    parse_coalesced_requests, parse_test_into_db, render_stored_question_screenshot,
+)
 from app.core.celery_app import celery_app
-from app.lib.celery_lock import sync_redis_lock
+from app.core.event_loop import run_async
+from app.lib.celery_lock import redis_lock
 from app.parser.exceptions import ParseException
+from app.settings.config import settings
 
 logger = get_task_logger(__name__)
 
+# Жёсткий time_limit работает только в prefork, в пуле потоков задачу ограничивает этот таймаут
+PARSE_TIMEOUT = 55
+PARSE_MAX_RETRIES = 2
+
+
+async def run_exclusively(task_id: str, job: Coroutine[Any, Any, None]) -> None:
+    async with redis_lock(f'{task_id}-lock', resource=task_id) as lock:
+        if not lock.acquired:
+            job.close()
+            logger.info('Task %s already processing', task_id)
+            return
+
+        try:
+            await job
+        except StaleFencingToken:
+            logger.warning('Task %s lost its lock, result is discarded', task_id)
+
+
+@celery_app.task(
+    bind=True,
+    autoretry_for=(ParseException,),
+    retry_kwargs={'max_retries': PARSE_MAX_RETRIES},
+    time_limit=60,
+)
+def parse_quiz_task(self, parse_request: TestParseRequest, test_page: Optional[str] = None) -> None:
+    task_id = self.request.id
+    job = parse_test_into_db(parse_request, test_page, final_attempt=self.request.retries >= PARSE_MAX_RETRIES)
+    run_async(run_exclusively(task_id, job), timeout=PARSE_TIMEOUT)
+
 
 @celery_app.task(
     bind=True,
@@ -17,11 +51,22 @@ logger = get_task_logger(__name__)
     retry_kwargs={'max_retries': 2},
     time_limit=60,
 )
-def parse_quiz_task(self, parse_request: TestParseRequest) -> None:
+def render_question_screenshot_task(self, domain: str, question_id: int) -> None:
     task_id = self.request.id
-    with sync_redis_lock(f'{task_id}-lock') as acquired:
-        if acquired:
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(parse_test_into_db(parse_request))
-        else:
-            logger.info('Task %s already processing', task_id)
+    run_async(
+        run_exclusively(task_id, render_stored_question_screenshot(domain, question_id)),
+        timeout=PARSE_TIMEOUT,
+    )
+
+
+# Запросы окна остаются в списке обработки до постановки задач разбора,
+# поэтому повтор после любой ошибки их не теряет. Повтор идёт через окно,
+# пока список обработки не истёк, так же повторяется задача, не получившая блокировку теста
+@celery_app.task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_kwargs={'max_retries': 2, 'countdown': settings.PARSE_COALESCE_WINDOW},
+    time_limit=60,
+)
+def parse_coalesced_task(self, domain: str, test_id: int) -> None:
+    run_async(parse_coalesced_requests(domain, test_id), timeout=PARSE_TIMEOUT)
@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import logging
+from io import BytesIO
+from typing import Dict, List, Optional, Set
+
+from app.applications.tests.dto import StoredScreenshot
+from app.applications.tests.models import Question
+from app.lib.aws import upload_file_to_s3
+from app.lib.progress import report_advance
+from app.parser.dto import CompletionStatus, QuestionDTO, ScreenshotFormat
+from app.parser.helpers import is_question_status_improved
+from app.parser.postprocessing import postprocess_screenshot
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def get_screenshot_hash(screenshot: bytes) -> str:
+    return hashlib.blake2b(screenshot, digest_size=16).hexdigest()
+
+
+async def upload_question_screenshot(
+    domain: str,
+    screenshot_hash: str,
+    screenshot: bytes,
+    screenshot_format: ScreenshotFormat = ScreenshotFormat.PNG,
+) -> StoredScreenshot:
+    screenshot, screenshot_format = await postprocess_screenshot(screenshot, screenshot_format)
+    screenshot_file = BytesIO(screenshot)
+    screenshot_name = f'{domain}/{screenshot_hash}.{screenshot_format.value}'
+    url = await upload_file_to_s3(settings.S3_QUESTIONS_BUCKET, screenshot_file, screenshot_name)
+    return StoredScreenshot(url=url, hash=screenshot_hash, format=screenshot_format)
+
+
+async def get_stored_screenshots(domain: str, screenshot_hashes: Set[str]) -> Dict[str, StoredScreenshot]:
+    if not screenshot_hashes:
+        return {}
+
+    stored_screenshots = await Question.filter(
+        domain=domain,
+        screenshot_hash__in=list(screenshot_hashes),
+    ).values_list('screenshot_hash', 'screenshot', 'screenshot_format')
+    return {
+        screenshot_hash: StoredScreenshot(url=url, hash=screenshot_hash, format=screenshot_format)
+        for screenshot_hash, url, screenshot_format in stored_screenshots
+    }
+
+
+class ScreenshotUploadPipeline:
+    """Загружает скриншоты вопросов по мере их получения парсером.
+
+    Очередь ограничена, поэтому при медленной загрузке парсер ждёт, и в памяти
+    одновременно не больше queue_size + workers скриншотов. Для сохранения в БД
+    остаются только статусы вопросов и адреса загруженных скриншотов.
+
+    Сохранённые статусы вопросов передаются заранее, а уже загруженные скриншоты
+    ищутся одним запросом на все хэши, накопившиеся у воркеров к этому моменту.
+    """
+
+    def __init__(
+        self,
+        domain: str,
+        existing_statuses: Dict[int, CompletionStatus],
+        queue_size: int,
+        workers: int,
+    ):
+        self.domain = domain
+        self.questions_statuses: Dict[int, CompletionStatus] = {}
+        self.screenshots: Dict[int, StoredScreenshot] = {}
+
+        self._existing_statuses = existing_statuses
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers_count = workers
+        self._workers: List[asyncio.Task] = []
+        self._uploads: Dict[str, asyncio.Task] = {}
+        self._lookups: Dict[str, asyncio.Future] = {}
+        self._pending_lookups: Set[str] = set()
+        self._lookup_task: Optional[asyncio.Task] = None
+        self._error: Optional[Exception] = None
+
+    async def __aenter__(self) -> 'ScreenshotUploadPipeline':
+        self._workers = [
+            asyncio.ensure_future(self._run_worker())
+            for _ in range(self._workers_count)
+        ]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            await self.join()
+            return
+
+        tasks = [*self._workers, *([self._lookup_task] if self._lookup_task else [])]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def put(self, question_dto: QuestionDTO) -> None:
+        self._raise_if_failed()
+        self.questions_statuses[question_dto.id] = question_dto.status
+        await self._queue.put(question_dto)
+
+    async def join(self) -> None:
+        for _ in self._workers:
+            await self._queue.put(None)
+        await asyncio.gather(*self._workers)
+        self._raise_if_failed()
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    async def _run_worker(self) -> None:
+        while (question_dto := await self._queue.get()) is not None:
+            # После ошибки очередь всё равно разбирается, чтобы парсер не завис на put
+            if self._error is not None:
+                continue
+            try:
+                await self._process(question_dto)
+            except Exception as exc:
+                self._error = exc
+            else:
+                await report_advance()
+
+    async def _process(self, question_dto: QuestionDTO) -> None:
+        if not self._is_upload_needed(question_dto):
+            return
+
+        # Одинаковые изображения загружаются один раз, уже сохранённые не загружаются вовсе
+        screenshot_hash = get_screenshot_hash(question_dto.screenshot)
+        upload = self._uploads.get(screenshot_hash)
+        if upload is None:
+            upload = asyncio.ensure_future(self._upload(screenshot_hash, question_dto))
+            self._uploads[screenshot_hash] = upload
+        self.screenshots[question_dto.id] = await upload
+
+    def _is_upload_needed(self, question_dto: QuestionDTO) -> bool:
+        existing_status = self._existing_statuses.get(question_dto.id)
+        if existing_status is None:
+            return True
+        return is_question_status_improved(existing_status, question_dto.status)
+
+    async def _get_stored_screenshot(self, screenshot_hash: str) -> Optional[StoredScreenshot]:
+        lookup = self._lookups.get(screenshot_hash)
+        if lookup is None:
+            lookup = asyncio.get_event_loop().create_future()
+            self._lookups[screenshot_hash] = lookup
+            self._pending_lookups.add(screenshot_hash)
+            if self._lookup_task is None:
+                self._lookup_task = asyncio.ensure_future(self._run_lookups())
+        return await lookup
+
+    async def _run_lookups(self) -> None:
+        try:
+            while self._pending_lookups:
+                # Даём остальным воркерам добавить свои хэши в тот же запрос
+                await asyncio.sleep(0)
+                screenshot_hashes, self._pending_lookups = self._pending_lookups, set()
+                lookups = [self._lookups[screenshot_hash] for screenshot_hash in screenshot_hashes]
+                try:
+                    stored_screenshots = await get_stored_screenshots(self.domain, screenshot_hashes)
+                except Exception as exc:
+                    for lookup in lookups:
+                        if not lookup.done():
+                            lookup.set_exception(exc)
+                    continue
+                for screenshot_hash, lookup in zip(screenshot_hashes, lookups):
+                    if not lookup.done():
+                        lookup.set_result(stored_screenshots.get(screenshot_hash))
+        finally:
+            self._lookup_task = None
+
+    async def _upload(self, screenshot_hash: str, question_dto: QuestionDTO) -> StoredScreenshot:
+        stored_screenshot = await self._get_stored_screenshot(screenshot_hash)
+        if stored_screenshot is not None:
+            return stored_screenshot
+
+        return await upload_question_screenshot(
+            self.domain,
+            screenshot_hash,
+            question_dto.screenshot,
+            question_dto.screenshot_format,
+        )
@@ -1,12 +1,19 @@
-import asyncio
 import logging
 
 from celery import Celery
-from celery.signals import worker_process_init, worker_process_shutdown
+from celery.signals import (
+    celeryd_init, task_prerun, worker_init, worker_process_init, worker_process_shutdown,
+    worker_shutdown,
+)
 from tortoise import Tortoise
 
+from app.core.event_loop import run_async, start_event_loop_thread, stop_event_loop_thread
 from app.core.init_app import get_apps_list, init_db
 from app.core.storage import connect_storage, disconnect_storage
+from app.lib.redis import close_redis_pools, init_redis_pools
+from app.parser.browser_pool import close_browser_pool, init_browser_pool
+from app.parser.http_client import close_http_clients, init_http_clients
+from app.settings.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -16,25 +23,92 @@ celery_app.config_from_object('app.settings.celery_config')
 celery_app.autodiscover_tasks(['app.core', *get_apps_list()])
 
 
-@worker_process_init.connect
-def startup(**kwargs):
-    logger.info('Initializing database connection for worker.')
-    loop = asyncio.get_event_loop()
+def _run_startup_tasks() -> None:
     startup_tasks = [
         init_db,
+        init_redis_pools,
         connect_storage,
+        init_http_clients,
     ]
+    if settings.PARSER_BACKEND == 'browser':
+        startup_tasks.append(init_browser_pool)
+
     for task in startup_tasks:
-        loop.run_until_complete(task())
+        run_async(task())
 
 
-@worker_process_shutdown.connect
-def shutdown(**kwargs):
-    logger.info('Closing database connection for worker.')
-    loop = asyncio.get_event_loop()
+def _run_shutdown_tasks() -> None:
     shutdown_tasks = [
         Tortoise.close_connections,
+        close_redis_pools,
         disconnect_storage,
+        close_http_clients,
+        close_browser_pool,
     ]
     for task in shutdown_tasks:
-        loop.run_until_complete(task())
+        run_async(task())
+
+
+@worker_process_init.connect
+def startup(**kwargs):
+    if settings.CELERY_ASYNC_EXECUTION:
+        return
+
+    logger.info('Initializing database connection for worker.')
+    _run_startup_tasks()
+
+
+@worker_process_shutdown.connect
+def shutdown(**kwargs):
+    if settings.CELERY_ASYNC_EXECUTION:
+        return
+
+    logger.info('Closing database connection for worker.')
+    _run_shutdown_tasks()
+
+
+@worker_init.connect
+def async_startup(**kwargs):
+    if not settings.CELERY_ASYNC_EXECUTION:
+        return
+
+    logger.info('Starting event loop and initializing connections for worker.')
+    start_event_loop_thread()
+    _run_startup_tasks()
+
+
+@worker_shutdown.connect
+def async_shutdown(**kwargs):
+    if not settings.CELERY_ASYNC_EXECUTION:
+        return
+
+    logger.info('Closing connections and stopping event loop for worker.')
+    _run_shutdown_tasks()
+    stop_event_loop_thread()
+
+
+@celeryd_init.connect
+def select_worker_queue(instance=None, conf=None, **kwargs):
+    queue = settings.CELERY_WORKER_QUEUE
+    if not queue:
+        return
+
+    instance.app.amqp.queues.select([queue])
+    if concurrency := settings.PARSE_QUEUES_CONCURRENCY.get(queue):
+        conf.worker_concurrency = concurrency
+
+
+@task_prerun.connect
+def track_queue_latency(task=None, **kwargs):
+    from app.applications.tests.queues import PARSE_QUEUES, record_queue_latency
+
+    request = task.request
+    queue = (request.delivery_info or {}).get('routing_key')
+    if queue not in PARSE_QUEUES:
+        return
+
+    enqueued_at = getattr(request, 'enqueued_at', None) or (request.headers or {}).get('enqueued_at')
+    try:
+        record_queue_latency(queue, enqueued_at)
+    except Exception:
+        logger.warning('Failed to record latency for queue %s', queue, exc_info=True)
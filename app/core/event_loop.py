@@ -0,0 +1,73 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Optional
+
+from app.settings.config import settings
+
+
+class EventLoopThread:
+    """Постоянный event loop в отдельном потоке процесса воркера.
+
+    Задачи Celery из пула потоков отправляют в него корутины и ждут результата,
+    поэтому один процесс выполняет одновременно много задач, ожидающих I/O.
+    """
+
+    def __init__(self, max_in_flight: int):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='asyncio-loop', daemon=True)
+        self._max_in_flight = max_in_flight
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _run_limited(self, coro: Awaitable[Any], timeout: Optional[float]) -> Any:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_in_flight)
+
+        async with self._semaphore:
+            return await asyncio.wait_for(coro, timeout)
+
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        future = asyncio.run_coroutine_threadsafe(self._run_limited(coro, timeout), self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+
+_loop_thread: Optional[EventLoopThread] = None
+
+
+def start_event_loop_thread() -> None:
+    global _loop_thread
+
+    if _loop_thread is None:
+        _loop_thread = EventLoopThread(max_in_flight=settings.CELERY_ASYNC_MAX_IN_FLIGHT)
+        _loop_thread.start()
+
+
+def stop_event_loop_thread() -> None:
+    global _loop_thread
+
+    if _loop_thread is not None:
+        _loop_thread.stop()
+        _loop_thread = None
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    if _loop_thread is not None:
+        return _loop_thread.run(coro, timeout)
+
+    loop = asyncio.get_event_loop()
+    return loop.run_until_complete(asyncio.wait_for(coro, timeout))
@@ -7,8 +7,12 @@ from sentry_sdk.integrations.asgi import SentryAsgiMiddleware
 from tortoise import Tortoise
 from tortoise.contrib.fastapi import register_tortoise
 
+from app.applications.tests.cache import (
+    start_invalidation_subscriber, stop_invalidation_subscriber,
+)
 from app.applications.tests.routes import router as tests_router
 from app.core.exceptions import APIException, on_api_exception
+from app.lib.redis import close_redis_pools, init_redis_pools
 from app.settings.config import settings
 from app.settings.log_config import LOGGING_CONFIG
 
@@ -74,6 +78,16 @@ async def init_db() -> None:
     )
 
 
+def register_redis(app: FastAPI) -> None:
+    app.add_event_handler('startup', init_redis_pools)
+    app.add_event_handler('shutdown', close_redis_pools)
+
+
+def register_cache(app: FastAPI) -> None:
+    app.add_event_handler('startup', start_invalidation_subscriber)
+    app.add_event_handler('shutdown', stop_invalidation_subscriber)
+
+
 def register_exceptions(app: FastAPI):
     app.add_exception_handler(APIException, on_api_exception)
 
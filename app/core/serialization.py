@@ -0,0 +1,77 @@
+from typing import Any, Dict, Tuple, Type
+
+import msgpack
+from kombu.serialization import register
+from pydantic import BaseModel
+
+from app.applications.tests.dto import QuestionScreenshotRequest, StoredScreenshot, TestParseRequest
+from app.parser.dto import QuestionDTO, TestInfoDTO, TestResultDTO, TestUrlInfoDTO
+
+SERIALIZER_NAME = 'moodle-msgpack'
+CONTENT_TYPE = 'application/x-moodle-msgpack'
+WIRE_VERSION = 1
+
+DTO_EXT_TYPE = 1
+
+# Коды типов нельзя менять и переиспользовать: по ним декодируются сообщения,
+# отправленные предыдущими версиями. Новые поля DTO добавляются только в конец
+# и только со значением по умолчанию.
+DTO_CODES: Dict[int, Type[BaseModel]] = {
+    1: TestParseRequest,
+    2: StoredScreenshot,
+    3: QuestionScreenshotRequest,
+    4: TestUrlInfoDTO,
+    5: TestInfoDTO,
+    6: QuestionDTO,
+    7: TestResultDTO,
+}
+DTO_TYPES: Dict[Type[BaseModel], int] = {dto: code for code, dto in DTO_CODES.items()}
+
+
+class UnsupportedWireVersion(ValueError):
+    pass
+
+
+def _encode_dto(obj: Any) -> msgpack.ExtType:
+    code = DTO_TYPES.get(type(obj))
+    if code is None:
+        raise TypeError(f'Object of type {type(obj).__name__} is not serializable')
+
+    values = [getattr(obj, field) for field in obj.__fields__]
+    return msgpack.ExtType(DTO_EXT_TYPE, msgpack.packb([code, values], default=_encode_dto))
+
+
+def _decode_dto(ext_type: int, data: bytes) -> Any:
+    if ext_type != DTO_EXT_TYPE:
+        return msgpack.ExtType(ext_type, data)
+
+    code, values = msgpack.unpackb(data, ext_hook=_decode_dto, strict_map_key=False)
+    dto = DTO_CODES[code]
+    return dto(**dict(zip(dto.__fields__, values)))
+
+
+def dumps(obj: Any) -> bytes:
+    return msgpack.packb([WIRE_VERSION, obj], default=_encode_dto)
+
+
+def loads(data: bytes) -> Any:
+    version, obj = msgpack.unpackb(data, ext_hook=_decode_dto, strict_map_key=False)
+    if version != WIRE_VERSION:
+        raise UnsupportedWireVersion(f'Unsupported wire format version {version}')
+    return obj
+
+
+def _celery_loads(data: Any) -> Tuple:
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    return loads(data)
+
+
+def register_serializer() -> None:
+    register(
+        SERIALIZER_NAME,
+        dumps,
+        _celery_loads,
+        content_type=CONTENT_TYPE,
+        content_encoding='binary',
+    )
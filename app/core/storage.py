@@ -0,0 +1,9 @@
+from app.lib.aws import close_s3_client, connect_s3_client
+
+
+async def connect_storage() -> None:
+    await connect_s3_client()
+
+
+async def disconnect_storage() -> None:
+    await close_s3_client()
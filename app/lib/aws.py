@@ -1,43 +1,77 @@
-import contextlib
+import asyncio
 import mimetypes
 import os
 from io import BytesIO
-from typing import Any
+from typing import Any, Optional
 
 import aioboto3
+from aiobotocore.config import AioConfig
 
 from app.settings.config import settings
 
+# До Python 3.11 mimetypes не знает WebP
+mimetypes.add_type('image/webp', '.webp')
 
-@contextlib.asynccontextmanager
-async def get_s3_resource():
-    async with aioboto3.resource(
+_s3_client_context: Optional[Any] = None
+_s3_client: Optional[Any] = None
+_s3_client_lock: Optional[asyncio.Lock] = None
+
+
+async def connect_s3_client() -> None:
+    global _s3_client, _s3_client_context
+
+    if _s3_client is not None:
+        return
+
+    _s3_client_context = aioboto3.client(
         service_name='s3',
         endpoint_url=settings.AWS_S3_ENDPOINT_URL,
         region_name=settings.AWS_S3_REGION_NAME,
         aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
         aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    ) as s3_res:
-        try:
-            yield s3_res
-        finally:
-            pass
+        config=AioConfig(
+            max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+            connector_args={'keepalive_timeout': settings.S3_KEEPALIVE_TIMEOUT},
+        ),
+    )
+    _s3_client = await _s3_client_context.__aenter__()
+
+
+async def close_s3_client() -> None:
+    global _s3_client, _s3_client_context
+
+    if _s3_client_context is not None:
+        await _s3_client_context.__aexit__(None, None, None)
+        _s3_client_context = None
+        _s3_client = None
+
+
+async def get_s3_client() -> Any:
+    global _s3_client_lock
+
+    # Клиент создаётся при старте воркера, здесь только страховка для кода вне воркера
+    if _s3_client is None:
+        if _s3_client_lock is None:
+            _s3_client_lock = asyncio.Lock()
+        async with _s3_client_lock:
+            await connect_s3_client()
+    return _s3_client
 
 
-async def upload_file_to_s3(bucket: Any, file: BytesIO, file_name: str) -> str:
+async def upload_file_to_s3(bucket_name: str, file: BytesIO, file_name: str) -> str:
+    s3_client = await get_s3_client()
     file.seek(0, os.SEEK_SET)
 
-    s3_obj = await bucket.Object(file_name)
-    await s3_obj.upload_fileobj(
-        Fileobj=file,
-        ExtraArgs={
-            'ContentType': mimetypes.guess_type(file_name)[0],
-            'ACL': 'public-read',
-        },
+    await s3_client.put_object(
+        Bucket=bucket_name,
+        Key=file_name,
+        Body=file.read(),
+        ContentType=mimetypes.guess_type(file_name)[0] or 'application/octet-stream',
+        ACL='public-read',
     )
 
     return '{base_url}/{bucket_name}/{file_name}'.format(
-        base_url=bucket.meta.client.meta.endpoint_url,
-        bucket_name=bucket.name,
+        base_url=s3_client.meta.endpoint_url,
+        bucket_name=bucket_name,
         file_name=file_name,
     )
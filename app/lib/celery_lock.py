@@ -1,19 +1,111 @@
-import time
-from contextlib import contextmanager
+import asyncio
+import contextlib
+import logging
+import uuid
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
 
-from app.lib.redis import redis_sync_client
+import aioredis
 
-LOCK_EXPIRE = 5 * 60  # 5 min
+from app.lib.redis import redis_async_client
+from app.settings.config import settings
 
+logger = logging.getLogger(__name__)
+
+FENCING_COUNTER_KEY = 'lock-fencing-token'
+
+RENEW_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+@dataclass
+class FencingToken:
+    resource: str
+    token: int
+
+
+@dataclass
+class LockHandle:
+    acquired: bool
+    fencing_token: Optional[FencingToken] = None
+    lost: bool = False
+
+
+current_lock: ContextVar[Optional[LockHandle]] = ContextVar('current_lock', default=None)
+
+
+async def _renew_lease(
+    redis_client: aioredis.Redis,
+    lock_id: str,
+    token: str,
+    handle: LockHandle,
+    ttl_ms: int,
+) -> None:
+    while True:
+        await asyncio.sleep(ttl_ms / 3 / 1000)
+        try:
+            renewed = await redis_client.eval(RENEW_SCRIPT, keys=[lock_id], args=[token, ttl_ms])
+        except (aioredis.RedisError, OSError):
+            logger.warning('Failed to renew lock %s', lock_id, exc_info=True)
+            continue
+
+        if not renewed:
+            logger.warning('Lock %s was lost before the work finished', lock_id)
+            handle.lost = True
+            return
+
+
+@contextlib.asynccontextmanager
+async def redis_lock(lock_id: str, resource: str) -> AsyncIterator[LockHandle]:
+    """Распределённая блокировка с продлением аренды и fencing-токеном.
+
+    Fencing-токен монотонно растёт между всеми захватами. Блокировка доступна
+    в current_lock, чтобы перед записью в БД проверить, что аренда не потеряна,
+    а сама запись могла отклонить устаревшего владельца по токену.
+    """
+    ttl_ms = int(settings.LOCK_TTL * 1000)
+    token = uuid.uuid4().hex
+
+    async with redis_async_client() as redis_client:
+        acquired = await redis_client.set(
+            lock_id,
+            token,
+            pexpire=ttl_ms,
+            exist=redis_client.SET_IF_NOT_EXIST,
+        )
+        if not acquired:
+            yield LockHandle(acquired=False)
+            return
+
+        fencing_token = FencingToken(
+            resource=resource,
+            token=await redis_client.incr(FENCING_COUNTER_KEY),
+        )
+        handle = LockHandle(acquired=True, fencing_token=fencing_token)
+        renewal = asyncio.ensure_future(_renew_lease(redis_client, lock_id, token, handle, ttl_ms))
+        context_token = current_lock.set(handle)
 
-@contextmanager
-def sync_redis_lock(lock_id: str):
-    with redis_sync_client() as redis_client:
-        timeout_at = time.monotonic() + LOCK_EXPIRE - 3
-        status = redis_client.set(lock_id, 'lock', nx=True, ex=LOCK_EXPIRE)
         try:
-            yield status
+            yield handle
         finally:
-            if time.monotonic() < timeout_at and status:
-                # don't release the lock if we didn't acquire it or if timeout already expired
-                redis_client.delete(lock_id)
+            current_lock.reset(context_token)
+            renewal.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await renewal
+            # Ошибка освобождения не должна скрыть исключение работы, блокировка истечёт по TTL
+            try:
+                await redis_client.eval(RELEASE_SCRIPT, keys=[lock_id], args=[token])
+            except (aioredis.RedisError, OSError):
+                logger.warning('Failed to release lock %s', lock_id, exc_info=True)
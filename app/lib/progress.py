@@ -0,0 +1,120 @@
+import contextlib
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from aioredis import RedisError
+
+from app.lib.redis import redis_async_client
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_PROGRESS_KEY = 'job-progress:{job_id}'
+
+
+class JobProgressUnavailable(Exception):
+    pass
+
+
+def get_job_progress_key(job_id: str) -> str:
+    return JOB_PROGRESS_KEY.format(job_id=job_id)
+
+
+async def write_jobs_progress(job_ids: Iterable[str], fields: Dict[str, Any]) -> None:
+    """Записывает одинаковый прогресс для нескольких задач одной транзакцией.
+
+    Ошибка относится только к записанному с ней этапу, поэтому без неё поле удаляется.
+    """
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+
+    fields = {**fields, 'updated_at': time.time()}
+    try:
+        async with redis_async_client() as redis_client:
+            transaction = redis_client.multi_exec()
+            for job_id in job_ids:
+                key = get_job_progress_key(job_id)
+                transaction.hmset_dict(key, fields)
+                if 'error' not in fields:
+                    transaction.hdel(key, 'error')
+                transaction.hincrby(key, 'version', 1)
+                transaction.expire(key, settings.JOB_PROGRESS_TTL)
+            await transaction.execute()
+    except (RedisError, OSError):
+        logger.warning('Failed to write progress of jobs %s', job_ids, exc_info=True)
+
+
+async def write_job_progress(job_id: str, fields: Dict[str, Any]) -> None:
+    await write_jobs_progress([job_id], fields)
+
+
+async def read_job_progress(job_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        async with redis_async_client() as redis_client:
+            progress = await redis_client.hgetall(get_job_progress_key(job_id), encoding='utf-8')
+    except (RedisError, OSError) as exc:
+        logger.warning('Failed to read progress of job %s', job_id, exc_info=True)
+        raise JobProgressUnavailable(job_id) from exc
+    return progress or None
+
+
+class JobProgress:
+    """Прогресс задачи в Redis.
+
+    Счётчики обновляются в памяти, а в Redis пишутся при смене этапа, по
+    завершении этапа и не чаще раза в JOB_PROGRESS_MIN_INTERVAL секунд.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.stage = ''
+        self.done = 0
+        self.total = 0
+        self._written_at = 0.0
+
+    async def set_stage(self, stage: str, **fields: Any) -> None:
+        self.stage = stage
+        await self._write(fields)
+
+    async def advance(self, count: int = 1) -> None:
+        self.done += count
+        if self.done >= self.total or time.monotonic() - self._written_at >= settings.JOB_PROGRESS_MIN_INTERVAL:
+            await self._write()
+
+    async def _write(self, fields: Optional[Dict[str, Any]] = None) -> None:
+        self._written_at = time.monotonic()
+        await write_job_progress(self.job_id, {
+            'stage': self.stage,
+            'done': self.done,
+            'total': self.total,
+            **(fields or {}),
+        })
+
+
+current_job_progress: ContextVar[Optional[JobProgress]] = ContextVar('current_job_progress', default=None)
+
+
+@contextlib.contextmanager
+def job_progress_context(job_id: str) -> Iterator[JobProgress]:
+    progress = JobProgress(job_id)
+    ctx_token = current_job_progress.set(progress)
+    try:
+        yield progress
+    finally:
+        current_job_progress.reset(ctx_token)
+
+
+async def report_stage(stage: str, total: Optional[int] = None) -> None:
+    if (progress := current_job_progress.get()) is None:
+        return
+    if total is not None:
+        progress.total = total
+    await progress.set_stage(stage)
+
+
+async def report_advance(count: int = 1) -> None:
+    if (progress := current_job_progress.get()) is not None:
+        await progress.advance(count)
@@ -0,0 +1,144 @@
+import asyncio
+import contextlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from aioredis import RedisError
+
+from app.lib.redis import redis_async_client
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+TOKENS_KEY = 'rate-limit:{key}:tokens'
+RATE_KEY = 'rate-limit:{key}:rate'
+LIMITER_KEY_TTL = 60 * 60
+
+# Токен резервируется сразу, даже если корзина пуста: запрос ждёт своей очереди,
+# а не конкурирует заново после пробуждения. Запрос, которому пришлось бы ждать
+# дольше max_wait, токен не резервирует и не уводит корзину в долг
+ACQUIRE_SCRIPT = '''
+redis.replicate_commands()
+local rate = tonumber(redis.call('HGET', KEYS[2], 'rate')) or tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate) - 1
+local wait = 0
+if tokens < 0 then
+    wait = -tokens / rate
+end
+if wait > tonumber(ARGV[4]) then
+    return tostring(wait)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return tostring(wait)
+'''
+
+# AIMD: аддитивный рост при быстрых успешных ответах, мультипликативное
+# снижение при ошибках не чаще одного раза за cooldown
+ADJUST_SCRIPT = '''
+redis.replicate_commands()
+local rate = tonumber(redis.call('HGET', KEYS[1], 'rate')) or tonumber(ARGV[1])
+local decreased_at = tonumber(redis.call('HGET', KEYS[1], 'decreased_at')) or 0
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+if ARGV[2] == '1' then
+    rate = math.min(tonumber(ARGV[4]), rate + tonumber(ARGV[5]))
+elseif now - decreased_at >= tonumber(ARGV[7]) then
+    rate = math.max(tonumber(ARGV[3]), rate * tonumber(ARGV[6]))
+    redis.call('HSET', KEYS[1], 'decreased_at', tostring(now))
+end
+redis.call('HSET', KEYS[1], 'rate', tostring(rate))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[8]))
+return tostring(rate)
+'''
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+@dataclass
+class RequestOutcome:
+    status_code: Optional[int] = None
+
+
+def _is_successful(outcome: RequestOutcome, latency: float, latency_threshold: float) -> bool:
+    if outcome.status_code is None or outcome.status_code >= 500:
+        return False
+    return latency <= latency_threshold
+
+
+async def acquire_token(key: str) -> None:
+    try:
+        async with redis_async_client() as redis_client:
+            wait = float(await redis_client.eval(
+                ACQUIRE_SCRIPT,
+                keys=[TOKENS_KEY.format(key=key), RATE_KEY.format(key=key)],
+                args=[
+                    settings.RATE_LIMIT_INITIAL_RATE,
+                    settings.RATE_LIMIT_BURST,
+                    LIMITER_KEY_TTL,
+                    settings.RATE_LIMIT_MAX_WAIT,
+                ],
+            ))
+    except (RedisError, OSError):
+        logger.warning('Rate limiter is unavailable, request to %s is not limited', key, exc_info=True)
+        return
+
+    if wait > settings.RATE_LIMIT_MAX_WAIT:
+        raise RateLimitExceeded(f'Rate limit for {key} requires waiting {wait:.1f}s')
+    if wait > 0:
+        await asyncio.sleep(wait)
+
+
+async def record_outcome(
+    key: str,
+    outcome: RequestOutcome,
+    latency: float,
+    latency_threshold: float,
+) -> None:
+    successful = _is_successful(outcome, latency, latency_threshold)
+    try:
+        async with redis_async_client() as redis_client:
+            await redis_client.eval(
+                ADJUST_SCRIPT,
+                keys=[RATE_KEY.format(key=key)],
+                args=[
+                    settings.RATE_LIMIT_INITIAL_RATE,
+                    '1' if successful else '0',
+                    settings.RATE_LIMIT_MIN_RATE,
+                    settings.RATE_LIMIT_MAX_RATE,
+                    settings.RATE_LIMIT_INCREASE,
+                    settings.RATE_LIMIT_DECREASE_FACTOR,
+                    settings.RATE_LIMIT_DECREASE_COOLDOWN,
+                    LIMITER_KEY_TTL,
+                ],
+            )
+    except (RedisError, OSError):
+        logger.warning('Rate limiter is unavailable, outcome for %s is not recorded', key, exc_info=True)
+
+
+@contextlib.asynccontextmanager
+async def rate_limited(
+    key: str,
+    latency_threshold: Optional[float] = None,
+) -> AsyncIterator[RequestOutcome]:
+    if latency_threshold is None:
+        latency_threshold = settings.RATE_LIMIT_LATENCY_THRESHOLD
+
+    await acquire_token(key)
+
+    outcome = RequestOutcome()
+    started_at = time.monotonic()
+    try:
+        yield outcome
+    finally:
+        await record_outcome(key, outcome, time.monotonic() - started_at, latency_threshold)
@@ -1,31 +1,118 @@
+import asyncio
 import contextlib
+import logging
+from typing import Any, Dict, Optional
 
 import aioredis
 import redis
 
 from app.settings.config import settings
 
+logger = logging.getLogger(__name__)
+
+REDIS_DB = 1
+
+_sync_pool: Optional[redis.BlockingConnectionPool] = None
+_async_pool: Optional[aioredis.Redis] = None
+_async_pool_lock: Optional[asyncio.Lock] = None
+
+
+def _get_redis_address() -> str:
+    return f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}'
+
+
+def init_redis_sync_pool() -> None:
+    global _sync_pool
+
+    if _sync_pool is None:
+        _sync_pool = redis.BlockingConnectionPool(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            password=settings.REDIS_PASSWORD,
+            db=REDIS_DB,
+            max_connections=settings.REDIS_POOL_MAX_SIZE,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        )
+
+
+def close_redis_sync_pool() -> None:
+    global _sync_pool
+
+    if _sync_pool is not None:
+        _sync_pool.disconnect()
+        _sync_pool = None
+
+
+async def init_redis_async_pool() -> None:
+    global _async_pool
+
+    if _async_pool is None:
+        _async_pool = await aioredis.create_redis_pool(
+            _get_redis_address(),
+            password=settings.REDIS_PASSWORD,
+            db=REDIS_DB,
+            minsize=settings.REDIS_POOL_MIN_SIZE,
+            maxsize=settings.REDIS_POOL_MAX_SIZE,
+            timeout=settings.REDIS_CONNECT_TIMEOUT,
+        )
+
+
+async def close_redis_async_pool() -> None:
+    global _async_pool
+
+    if _async_pool is not None:
+        _async_pool.close()
+        await _async_pool.wait_closed()
+        _async_pool = None
+
+
+async def init_redis_pools() -> None:
+    init_redis_sync_pool()
+    await init_redis_async_pool()
+
+
+async def close_redis_pools() -> None:
+    close_redis_sync_pool()
+    await close_redis_async_pool()
+
+
+async def _get_async_pool() -> aioredis.Redis:
+    global _async_pool_lock
+
+    # Пул создаётся при старте приложения или воркера, здесь только страховка
+    # для кода, запущенного вне них (скрипты, консоль)
+    if _async_pool is None:
+        if _async_pool_lock is None:
+            _async_pool_lock = asyncio.Lock()
+        async with _async_pool_lock:
+            await init_redis_async_pool()
+    return _async_pool
+
 
 @contextlib.contextmanager
 def redis_sync_client() -> redis.Redis:
-    client = redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        password=settings.REDIS_PASSWORD,
-        db=1,
-    )
-    try:
-        yield client
-    finally:
-        client.close()
+    if _sync_pool is None:
+        init_redis_sync_pool()
+    yield redis.Redis(connection_pool=_sync_pool)
 
 
 @contextlib.asynccontextmanager
 async def redis_async_client() -> aioredis.Redis:
+    """Клиент поверх общего пула: каждая команда берёт соединение из пула и возвращает его."""
+    yield await _get_async_pool()
+
+
+@contextlib.asynccontextmanager
+async def redis_pubsub_client() -> aioredis.Redis:
+    """Выделенное соединение для подписок, которое нельзя возвращать в общий пул."""
     client = await aioredis.create_redis(
-        f'redis://{settings.REDIS_HOST}:{settings.REDIS_PORT}',
+        _get_redis_address(),
         password=settings.REDIS_PASSWORD,
-        db=1,
+        db=REDIS_DB,
+        timeout=settings.REDIS_CONNECT_TIMEOUT,
     )
 
     try:
@@ -33,3 +120,62 @@ async def redis_async_client() -> aioredis.Redis:
     finally:
         client.close()
         await client.wait_closed()
+
+
+def _get_sync_pool_stats() -> Optional[Dict[str, Any]]:
+    if _sync_pool is None:
+        return None
+
+    created = len(_sync_pool._connections)
+    idle = sum(1 for connection in list(_sync_pool.pool.queue) if connection is not None)
+    return {
+        'max_size': _sync_pool.max_connections,
+        'created': created,
+        'idle': idle,
+        'in_use': created - idle,
+    }
+
+
+def _get_async_pool_stats() -> Optional[Dict[str, Any]]:
+    if _async_pool is None:
+        return None
+
+    pool = _async_pool.connection
+    return {
+        'min_size': pool.minsize,
+        'max_size': pool.maxsize,
+        'created': pool.size,
+        'idle': pool.freesize,
+        'in_use': pool.size - pool.freesize,
+    }
+
+
+async def check_redis_health() -> Dict[str, bool]:
+    health = {'sync': False, 'async': False}
+
+    if _sync_pool is not None:
+        try:
+            # redis-py синхронный, поэтому проверка не должна блокировать event loop
+            health['sync'] = await asyncio.get_event_loop().run_in_executor(
+                None, redis.Redis(connection_pool=_sync_pool).ping,
+            )
+        except (redis.RedisError, OSError):
+            logger.warning('Sync Redis pool health check failed', exc_info=True)
+
+    if _async_pool is not None:
+        try:
+            health['async'] = await asyncio.wait_for(
+                _async_pool.ping(), timeout=settings.REDIS_SOCKET_TIMEOUT,
+            ) == b'PONG'
+        except (aioredis.RedisError, OSError, asyncio.TimeoutError):
+            logger.warning('Async Redis pool health check failed', exc_info=True)
+
+    return health
+
+
+async def get_redis_pools_stats() -> Dict[str, Any]:
+    return {
+        'sync': _get_sync_pool_stats(),
+        'async': _get_async_pool_stats(),
+        'health': await check_redis_health(),
+    }
@@ -4,8 +4,8 @@ from fastapi import FastAPI
 
 from app.core.exceptions import SettingNotFound
 from app.core.init_app import (
-    configure_logging, init_middlewares, register_db, register_exceptions,
-    register_routers,
+    configure_logging, init_middlewares, register_cache, register_db,
+    register_exceptions, register_redis, register_routers,
 )
 
 try:
@@ -29,6 +29,8 @@ def create_app() -> FastAPI:
     configure_logging()
     init_middlewares(app)
     register_db(app)
+    register_redis(app)
+    register_cache(app)
     register_exceptions(app)
     register_routers(app)
 
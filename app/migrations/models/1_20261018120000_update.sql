@@ -0,0 +1,6 @@
+##### upgrade #####
+ALTER TABLE "question" ADD "screenshot_hash" VARCHAR(32);
+CREATE INDEX IF NOT EXISTS "idx_question_screens_3c1f2a" ON "question" ("screenshot_hash");
+##### downgrade #####
+DROP INDEX IF EXISTS "idx_question_screens_3c1f2a";
+ALTER TABLE "question" DROP COLUMN "screenshot_hash";
@@ -0,0 +1,5 @@
+##### upgrade #####
+ALTER TABLE "question" ADD "screenshot_format" VARCHAR(4) NOT NULL DEFAULT 'png';
+COMMENT ON COLUMN "question"."screenshot_format" IS 'PNG: png\nHTML: html';
+##### downgrade #####
+ALTER TABLE "question" DROP COLUMN "screenshot_format";
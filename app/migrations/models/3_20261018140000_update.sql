@@ -0,0 +1,9 @@
+##### upgrade #####
+CREATE TABLE IF NOT EXISTS "parse_fence" (
+    "job_id" VARCHAR(255) NOT NULL  PRIMARY KEY,
+    "token" BIGINT NOT NULL,
+    "updated_at" TIMESTAMPTZ NOT NULL  DEFAULT CURRENT_TIMESTAMP
+);
+COMMENT ON TABLE "parse_fence" IS 'Последний fencing-токен, с которым записан результат задачи разбора.';
+##### downgrade #####
+DROP TABLE IF EXISTS "parse_fence";
@@ -0,0 +1,4 @@
+##### upgrade #####
+COMMENT ON COLUMN "question"."screenshot_format" IS 'PNG: png\nHTML: html\nWEBP: webp';
+##### downgrade #####
+COMMENT ON COLUMN "question"."screenshot_format" IS 'PNG: png\nHTML: html';
@@ -0,0 +1,12 @@
+##### upgrade #####
+-- aerich выполняет миграцию в транзакции, а CONCURRENTLY в ней запрещён: транзакция
+-- завершается перед построением индекса и открывается снова для записи о миграции.
+-- Прерванное построение оставляет невалидный индекс, поэтому он сначала удаляется
+COMMIT;
+DROP INDEX CONCURRENTLY IF EXISTS "idx_question_domain_covering";
+CREATE INDEX CONCURRENTLY "idx_question_domain_covering" ON "question" ("domain", "question_id") INCLUDE ("status", "screenshot", "screenshot_format");
+BEGIN;
+##### downgrade #####
+COMMIT;
+DROP INDEX CONCURRENTLY IF EXISTS "idx_question_domain_covering";
+BEGIN;
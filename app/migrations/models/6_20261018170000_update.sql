@@ -0,0 +1,4 @@
+##### upgrade #####
+CREATE INDEX IF NOT EXISTS "idx_parse_fenc_updated_4e1c3a" ON "parse_fence" ("updated_at");
+##### downgrade #####
+DROP INDEX IF EXISTS "idx_parse_fenc_updated_4e1c3a";
@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+
+from pyppeteer.browser import Browser, BrowserContext
+
+from app.parser.helpers import get_headless_browser, launch_headless_browser
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Простаивающий браузер перед выдачей проверяется запросом по CDP не чаще этого интервала
+HEALTH_CHECK_INTERVAL = 30
+
+
+@dataclass
+class PooledBrowser:
+    browser: Browser
+    pages_served: int = 0
+    in_use: int = 0
+    retired: bool = False
+    checked_at: float = 0.0
+
+    @property
+    def pid(self) -> Optional[int]:
+        process = self.browser.process
+        return process.pid if process else None
+
+    def is_alive(self) -> bool:
+        process = self.browser.process
+        return process is not None and process.poll() is None
+
+
+@dataclass
+class BrowserPoolStats:
+    size: int
+    alive: int = 0
+    contexts_in_use: int = 0
+    pages_served: int = 0
+    launched: int = 0
+    recycled: int = 0
+    health_check_failures: int = 0
+
+
+def _read_children_pids(pid: int) -> List[int]:
+    children: List[int] = []
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except (OSError, ValueError):
+        return children
+
+    for child in list(children):
+        children.extend(_read_children_pids(child))
+    return children
+
+
+def _read_rss_mb(pid: int) -> float:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0.0
+
+
+def get_browser_rss_mb(pooled: PooledBrowser) -> float:
+    """Суммарный RSS процесса браузера и его дочерних процессов (рендереров)."""
+    pid = pooled.pid
+    if pid is None:
+        return 0.0
+    return sum(_read_rss_mb(p) for p in (pid, *_read_children_pids(pid)))
+
+
+class BrowserPool:
+    def __init__(
+        self,
+        size: int,
+        max_contexts: int,
+        max_pages: int,
+        max_memory_mb: int,
+        health_check_timeout: float,
+    ):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self.health_check_timeout = health_check_timeout
+
+        self._browsers: List[PooledBrowser] = []
+        self._lock = asyncio.Lock()
+        self._semaphore = asyncio.Semaphore(max_contexts)
+        self._stats = BrowserPoolStats(size=size)
+
+    async def start(self) -> None:
+        async with self._lock:
+            while len(self._browsers) < self.size:
+                self._browsers.append(await self._launch())
+
+    async def close(self) -> None:
+        async with self._lock:
+            browsers, self._browsers = self._browsers, []
+            for pooled in browsers:
+                await self._close_browser(pooled)
+
+    @contextlib.asynccontextmanager
+    async def context(self) -> AsyncIterator[BrowserContext]:
+        async with self._semaphore:
+            pooled = await self._acquire()
+            try:
+                context = await pooled.browser.createIncognitoBrowserContext()
+            except Exception:
+                pooled.retired = True
+                await self._release(pooled)
+                raise
+
+            try:
+                yield context
+            finally:
+                try:
+                    await context.close()
+                except Exception:
+                    logger.exception('Failed to close browser context, retiring browser %s', pooled.pid)
+                    pooled.retired = True
+                pooled.pages_served += 1
+                self._stats.pages_served += 1
+                await self._release(pooled)
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._stats.alive = sum(1 for pooled in self._browsers if pooled.is_alive())
+        self._stats.contexts_in_use = sum(pooled.in_use for pooled in self._browsers)
+        return {
+            **self._stats.__dict__,
+            'browsers': [
+                {
+                    'pid': pooled.pid,
+                    'pages_served': pooled.pages_served,
+                    'in_use': pooled.in_use,
+                    'retired': pooled.retired,
+                    'rss_mb': round(get_browser_rss_mb(pooled), 1),
+                }
+                for pooled in self._browsers
+            ],
+        }
+
+    async def _launch(self) -> PooledBrowser:
+        browser = await launch_headless_browser()
+        self._stats.launched += 1
+        logger.info('Launched pooled browser %s', browser.process.pid if browser.process else None)
+        return PooledBrowser(browser=browser, checked_at=time.monotonic())
+
+    async def _close_browser(self, pooled: PooledBrowser) -> None:
+        try:
+            await pooled.browser.close()
+        except Exception:
+            logger.exception('Failed to close pooled browser %s', pooled.pid)
+
+    async def _is_healthy(self, pooled: PooledBrowser) -> bool:
+        if not pooled.is_alive():
+            self._stats.health_check_failures += 1
+            return False
+
+        # Занятый браузер заведомо отвечает, а проверка недавно проверенного не нужна
+        if pooled.in_use or time.monotonic() - pooled.checked_at < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            await asyncio.wait_for(pooled.browser.version(), timeout=self.health_check_timeout)
+        except Exception:
+            logger.warning('Pooled browser %s failed health check', pooled.pid, exc_info=True)
+            self._stats.health_check_failures += 1
+            return False
+        pooled.checked_at = time.monotonic()
+        return True
+
+    async def _replace_retired(self) -> None:
+        retired = [pooled for pooled in self._browsers if pooled.retired and pooled.in_use == 0]
+        for pooled in retired:
+            logger.info('Recycling pooled browser %s after %d pages', pooled.pid, pooled.pages_served)
+            self._browsers.remove(pooled)
+            await self._close_browser(pooled)
+            self._stats.recycled += 1
+            logger.info('Browser pool stats: %s', self.get_stats())
+
+        while len(self._browsers) < self.size:
+            self._browsers.append(await self._launch())
+
+    async def _acquire(self) -> PooledBrowser:
+        async with self._lock:
+            for pooled in self._browsers:
+                if not pooled.retired and not await self._is_healthy(pooled):
+                    pooled.retired = True
+            await self._replace_retired()
+
+            candidates = [pooled for pooled in self._browsers if not pooled.retired]
+            if not candidates:
+                pooled = await self._launch()
+                self._browsers.append(pooled)
+                candidates = [pooled]
+
+            pooled = min(candidates, key=lambda candidate: candidate.in_use)
+            pooled.in_use += 1
+            return pooled
+
+    async def _release(self, pooled: PooledBrowser) -> None:
+        pooled.in_use -= 1
+
+        if pooled.pages_served >= self.max_pages:
+            pooled.retired = True
+        elif self.max_memory_mb and get_browser_rss_mb(pooled) > self.max_memory_mb:
+            logger.info('Pooled browser %s exceeded memory limit', pooled.pid)
+            pooled.retired = True
+
+        if not pooled.retired or pooled.in_use:
+            return
+
+        async with self._lock:
+            if pooled in self._browsers:
+                await self._replace_retired()
+
+
+browser_pool: Optional[BrowserPool] = None
+
+
+async def init_browser_pool() -> None:
+    global browser_pool
+
+    browser_pool = BrowserPool(
+        size=settings.BROWSER_POOL_SIZE,
+        max_contexts=settings.BROWSER_POOL_MAX_CONTEXTS,
+        max_pages=settings.BROWSER_MAX_PAGES,
+        max_memory_mb=settings.BROWSER_MAX_MEMORY_MB,
+        health_check_timeout=settings.BROWSER_HEALTH_CHECK_TIMEOUT,
+    )
+    await browser_pool.start()
+
+
+async def close_browser_pool() -> None:
+    global browser_pool
+
+    if browser_pool is not None:
+        logger.info('Browser pool stats: %s', browser_pool.get_stats())
+        await browser_pool.close()
+        browser_pool = None
+
+
+def get_browser_pool_stats() -> Optional[Dict[str, Any]]:
+    if browser_pool is None:
+        return None
+    return browser_pool.get_stats()
+
+
+@contextlib.asynccontextmanager
+async def get_browser_context() -> AsyncIterator[Union[Browser, BrowserContext]]:
+    """Изолированный контекст из пула браузеров процесса.
+
+    Вне воркера (пул не инициализирован) запускается отдельный браузер.
+    """
+    if browser_pool is None:
+        async with get_headless_browser() as browser:
+            yield browser
+        return
+
+    async with browser_pool.context() as context:
+        yield context
@@ -6,3 +6,56 @@ QUESTIONS_SELECTOR = 'div[id^="question-"]:not(.description)'
 FLAG_INPUT_SELECTOR = 'input.questionflagpostdata'
 
 NOT_ANSWERED_CLASS = 'notanswered'
+GRADE_SELECTOR = 'div.grade'
+
+QUESTIONS_EXTRACT_SCRIPT = '''(questionsSelector, flagSelector, gradeSelector) => {
+    return Array.from(document.querySelectorAll(questionsSelector)).map(el => {
+        const flagInput = el.querySelector(flagSelector);
+        const grade = el.querySelector(gradeSelector);
+        const rect = el.getBoundingClientRect();
+        return {
+            flag_value: flagInput ? flagInput.value : null,
+            class_name: el.className,
+            grade: grade ? grade.innerText : null,
+            box: {
+                x: rect.left + window.scrollX,
+                y: rect.top + window.scrollY,
+                width: rect.width,
+                height: rect.height,
+            },
+        };
+    });
+}'''
+
+# Документ вопроса публикуется, поэтому в нём остаётся только разметка из списков ниже.
+# Содержимое этих тегов удаляется целиком, остальные неразрешённые теги разворачиваются
+DROPPED_TAGS_SELECTOR = (
+    'script, noscript, style, template, iframe, frame, frameset, object, embed, applet, '
+    'svg, math, meta, link, base, title, audio, video, source, track, canvas, portal'
+)
+ALLOWED_TAGS = frozenset({
+    'a', 'abbr', 'b', 'bdi', 'bdo', 'blockquote', 'br', 'caption', 'center', 'cite', 'code',
+    'col', 'colgroup', 'dd', 'del', 'dfn', 'div', 'dl', 'dt', 'em', 'fieldset', 'figcaption',
+    'figure', 'font', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'img', 'input', 'ins',
+    'kbd', 'label', 'legend', 'li', 'mark', 'ol', 'option', 'optgroup', 'p', 'pre', 'q', 's',
+    'samp', 'select', 'small', 'span', 'strike', 'strong', 'sub', 'sup', 'table', 'tbody',
+    'td', 'textarea', 'tfoot', 'th', 'thead', 'tr', 'tt', 'u', 'ul', 'var', 'wbr',
+})
+ALLOWED_ATTRIBUTES = frozenset({
+    'align', 'alt', 'border', 'cellpadding', 'cellspacing', 'checked', 'class', 'color',
+    'cols', 'colspan', 'dir', 'disabled', 'face', 'for', 'headers', 'height', 'href', 'id',
+    'label', 'lang', 'multiple', 'name', 'readonly', 'role', 'rows', 'rowspan', 'scope',
+    'selected', 'size', 'span', 'src', 'start', 'style', 'title', 'type', 'valign', 'value',
+    'width',
+})
+URL_ATTRIBUTES = frozenset({'href', 'src'})
+ALLOWED_URL_SCHEMES = frozenset({'http', 'https', 'mailto'})
+ALLOWED_DATA_URL_PREFIXES = (
+    'data:image/png;', 'data:image/jpeg;', 'data:image/gif;', 'data:image/webp;',
+)
+# Скрытые поля Moodle (questionflagpostdata, :sequencecheck) содержат sesskey пользователя
+ALLOWED_INPUT_TYPES = frozenset({'checkbox', 'radio', 'text'})
+SESSION_KEY_MARKER = 'sesskey'
+# Внешние ресурсы из стилей уходят на сторонние адреса, выражения выполняются в старых браузерах
+UNSAFE_STYLE_TOKENS = ('url(', 'image-set(', 'expression(', '@import', 'behavior', '-moz-binding', '\\')
+STYLESHEETS_SELECTOR = 'link[rel="stylesheet"][href]'
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import List
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel
 
@@ -11,10 +11,54 @@ class CompletionStatus(str, Enum):
     NOT_ANSWERED = 'NOT_ANSWERED'
 
 
+class ScreenshotFormat(str, Enum):
+    PNG = 'png'
+    HTML = 'html'
+    WEBP = 'webp'
+
+
+class ParseStage(str, Enum):
+    QUEUED = 'queued'
+    FETCHING = 'fetching'
+    RENDERING = 'rendering'
+    UPLOADING = 'uploading'
+    RETRYING = 'retrying'
+    SAVED = 'saved'
+    SKIPPED = 'skipped'
+    SATISFIED = 'satisfied'
+    FAILED = 'failed'
+
+
+class BoundingBoxDTO(BaseModel):
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+class PageQuestionDTO(BaseModel):
+    flag_value: Optional[str]
+    class_name: str
+    grade: Optional[str]
+    box: BoundingBoxDTO
+
+
 class QuestionDTO(BaseModel):
     id: int
     screenshot: bytes
     status: CompletionStatus
+    screenshot_format: ScreenshotFormat = ScreenshotFormat.PNG
+
+
+class PostprocessOptionsDTO(BaseModel):
+    trim: bool
+    trim_padding: int
+    max_width: Optional[int]
+    encoding: Literal['png', 'webp']
+    png_quantize: bool
+    png_colors: int
+    webp_quality: int
+    webp_lossless: bool
 
 
 class TestInfoDTO(BaseModel):
@@ -7,11 +7,21 @@ from pyppeteer import launch
 from pyppeteer.browser import Browser
 from pyppeteer.element_handle import ElementHandle
 
-from app.parser.dto import TestUrlInfoDTO
+from app.parser.dto import CompletionStatus, TestUrlInfoDTO
 from app.parser.exceptions import ParseException
 from app.settings.config import settings
 
 
+def is_question_status_improved(old_status: CompletionStatus, new_status: CompletionStatus) -> bool:
+    if old_status == CompletionStatus.CORRECT:
+        return False
+
+    if old_status == CompletionStatus.PARTIALLY_CORRECT and new_status != CompletionStatus.CORRECT:
+        return False
+
+    return True
+
+
 @lru_cache
 def get_test_info_from_attempt_url(url: str) -> TestUrlInfoDTO:
     split_result = urlsplit(url)
@@ -27,14 +37,21 @@ def get_test_info_from_attempt_url(url: str) -> TestUrlInfoDTO:
     )
 
 
-@contextlib.asynccontextmanager
-async def get_headless_browser() -> Browser:
+async def launch_headless_browser() -> Browser:
     default_viewport = {'width': 1920, 'height': 20000, 'deviceScaleFactor': 1}
-    browser = await launch({
+    return await launch({
         'defaultViewport': default_viewport,
         'executablePath': settings.CHROMIUM_PATH,
+        'handleSIGINT': False,
+        'handleSIGTERM': False,
+        'handleSIGHUP': False,
     })
 
+
+@contextlib.asynccontextmanager
+async def get_headless_browser() -> Browser:
+    browser = await launch_headless_browser()
+
     try:
         yield browser
     finally:
@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import html
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import urljoin, urlsplit
+
+import httpx
+from selectolax.parser import HTMLParser, Node
+
+from app.lib.progress import report_stage
+from app.lib.rate_limiter import RateLimitExceeded, rate_limited
+from app.parser.constants import (
+    ALLOWED_ATTRIBUTES, ALLOWED_DATA_URL_PREFIXES, ALLOWED_INPUT_TYPES, ALLOWED_TAGS, ALLOWED_URL_SCHEMES,
+    DROPPED_TAGS_SELECTOR, FLAG_INPUT_SELECTOR, QUESTIONS_SELECTOR, SESSION_KEY_MARKER, STYLESHEETS_SELECTOR,
+    UNSAFE_STYLE_TOKENS, URL_ATTRIBUTES,
+)
+from app.parser.dto import (
+    CompletionStatus, ParseStage, QuestionDTO, ScreenshotFormat, TestInfoDTO, TestResultDTO,
+)
+from app.parser.helpers import get_test_info_from_attempt_url
+from app.parser.http_client import get_moodle_client, get_session_headers
+from app.parser.logic import (
+    QuestionConsumer, collect_questions, get_page_questions_statuses,
+    get_question_id_from_flag_input, get_questions_for_skip_or_raise, get_test_name, request_test_page,
+)
+from app.settings.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Политика запрещает скрипты и формы на случай, если санитайзер что-то пропустил
+QUESTION_DOCUMENT_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta http-equiv="Content-Security-Policy" content="default-src 'none'; style-src {origin} 'unsafe-inline'; \
+font-src {origin} data:; img-src {origin} data:; base-uri {origin}; form-action 'none'">
+<base href="{base_url}">
+{stylesheets}
+</head>
+<body id="{body_id}" class="{body_class}">
+<div id="page-content"><div role="main">{question}</div></div>
+</body>
+</html>
+'''
+
+
+def _get_stylesheets(tree: HTMLParser, page_url: str) -> List[str]:
+    # Стили темы Moodle публичные и большие, поэтому подключаются ссылкой, а не встраиваются
+    return [
+        urljoin(page_url, link.attributes['href'])
+        for link in tree.css(STYLESHEETS_SELECTOR)
+    ]
+
+
+def _is_allowed_url(tag: str, url: str) -> bool:
+    # Браузеры игнорируют пробелы и управляющие символы в схеме, например "java\tscript:"
+    url = ''.join(char for char in url if char > ' ').lower()
+    if url.startswith('data:'):
+        return tag == 'img' and url.startswith(ALLOWED_DATA_URL_PREFIXES)
+    try:
+        scheme = urlsplit(url).scheme
+    except ValueError:
+        return False
+    return not scheme or scheme in ALLOWED_URL_SCHEMES
+
+
+def _is_allowed_attribute(tag: str, name: str, value: Optional[str]) -> bool:
+    if name not in ALLOWED_ATTRIBUTES:
+        return False
+    if value is None:
+        return True
+    if SESSION_KEY_MARKER in value.lower():
+        return False
+    if name in URL_ATTRIBUTES:
+        return (name, tag) in {('href', 'a'), ('src', 'img')} and _is_allowed_url(tag, value)
+    if name == 'style':
+        return not any(token in value.lower() for token in UNSAFE_STYLE_TOKENS)
+    if name == 'type' and tag == 'input':
+        return value.lower() in ALLOWED_INPUT_TYPES
+    return True
+
+
+def _sanitize_question(question_el: Node) -> None:
+    """Оставляет в вопросе только разрешённые теги, атрибуты и схемы адресов."""
+    for dropped_el in question_el.css(DROPPED_TAGS_SELECTOR):
+        dropped_el.decompose()
+
+    for el in [question_el, *question_el.css('*')]:
+        if el.tag == 'input' and (el.attributes.get('type') or '').lower() == 'hidden':
+            el.decompose()
+            continue
+        for name, value in list(el.attributes.items()):
+            if not _is_allowed_attribute(el.tag, name.lower(), value):
+                del el.attrs[name]
+        if el is not question_el and el.tag not in ALLOWED_TAGS:
+            el.unwrap()
+
+
+async def _fetch_image(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    domain: str,
+    headers: Dict[str, str],
+    image_url: str,
+) -> Optional[str]:
+    async with semaphore:
+        try:
+            async with rate_limited(domain) as outcome:
+                response = await client.get(image_url, headers=headers)
+                outcome.status_code = response.status_code
+            response.raise_for_status()
+        except (httpx.HTTPError, RateLimitExceeded):
+            logger.warning('Не удалось загрузить изображение %s', image_url)
+            return None
+
+    content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+    data_uri_prefix = f'data:{content_type};'
+    if not data_uri_prefix.startswith(ALLOWED_DATA_URL_PREFIXES):
+        logger.warning('Изображение %s имеет неподдерживаемый тип %s', image_url, content_type)
+        return None
+
+    encoded = base64.b64encode(response.content).decode('ascii')
+    return f'{data_uri_prefix}base64,{encoded}'
+
+
+async def _inline_images(cookie: str, domain: str, questions_els: List[Node], page_url: str) -> None:
+    images_els: Dict[str, List[Node]] = {}
+    for question_el in questions_els:
+        for image_el in question_el.css('img[src]'):
+            src = image_el.attributes['src']
+            if not src or src.startswith('data:'):
+                continue
+            image_url = urljoin(page_url, src)
+            # Сессия пользователя передаётся только самому Moodle, изображения
+            # с других хостов не встраиваются и блокируются политикой документа
+            if urlsplit(image_url).netloc != domain:
+                continue
+            images_els.setdefault(image_url, []).append(image_el)
+
+    if not images_els:
+        return
+
+    semaphore = asyncio.Semaphore(settings.HTML_IMAGES_CONCURRENCY)
+    client = get_moodle_client(domain)
+    headers = get_session_headers(cookie)
+    images_urls = list(images_els)
+    data_uris = await asyncio.gather(*(
+        _fetch_image(client, semaphore, domain, headers, image_url)
+        for image_url in images_urls
+    ))
+
+    for image_url, data_uri in zip(images_urls, data_uris):
+        if data_uri is None:
+            continue
+        for image_el in images_els[image_url]:
+            image_el.attrs['src'] = data_uri
+            if 'srcset' in image_el.attributes:
+                del image_el.attrs['srcset']
+
+
+def _build_question_document(
+    question_el: Node,
+    page_url: str,
+    stylesheets: List[str],
+    body_el: Optional[Node],
+) -> bytes:
+    body_attributes = body_el.attributes if body_el is not None else {}
+    page_url_parts = urlsplit(page_url)
+    document = QUESTION_DOCUMENT_TEMPLATE.format(
+        origin=html.escape(f'{page_url_parts.scheme}://{page_url_parts.netloc}'),
+        base_url=html.escape(page_url),
+        stylesheets='\n'.join(
+            f'<link rel="stylesheet" href="{html.escape(stylesheet)}">'
+            for stylesheet in stylesheets
+        ),
+        body_id=html.escape(body_attributes.get('id') or ''),
+        body_class=html.escape(body_attributes.get('class') or ''),
+        question=question_el.html,
+    )
+    return document.encode('utf-8')
+
+
+async def _build_questions(
+    questions_els: Dict[int, Node],
+    page_questions: Dict[int, CompletionStatus],
+    page_url: str,
+    stylesheets: List[str],
+    body_el: Optional[Node],
+) -> AsyncIterator[QuestionDTO]:
+    for question_id, question_el in questions_els.items():
+        yield QuestionDTO(
+            id=question_id,
+            screenshot=_build_question_document(question_el, page_url, stylesheets, body_el),
+            status=page_questions[question_id],
+            screenshot_format=ScreenshotFormat.HTML,
+        )
+
+
+async def parse_test_html(
+    cookie: str,
+    test_attempt_url: str,
+    existing_questions: Dict[int, CompletionStatus],
+    on_question: Optional[QuestionConsumer] = None,
+    test_page: Optional[str] = None,
+) -> TestResultDTO:
+    test_url_info = get_test_info_from_attempt_url(test_attempt_url)
+    if test_page is None:
+        test_page = await request_test_page(cookie, test_attempt_url)
+    tree = HTMLParser(test_page)
+    page_questions = get_page_questions_statuses(tree)
+    questions_for_skip = get_questions_for_skip_or_raise(page_questions, existing_questions)
+
+    questions_els: Dict[int, Node] = {}
+    for question_el in tree.css(QUESTIONS_SELECTOR):
+        flag_input_value = question_el.css_first(FLAG_INPUT_SELECTOR).attributes['value']
+        question_id = get_question_id_from_flag_input(flag_input_value)
+        if question_id not in questions_for_skip:
+            questions_els[question_id] = question_el
+
+    await report_stage(ParseStage.RENDERING, total=len(questions_els))
+    for question_el in questions_els.values():
+        _sanitize_question(question_el)
+    await _inline_images(cookie, test_url_info.domain, list(questions_els.values()), test_attempt_url)
+
+    questions = await collect_questions(
+        _build_questions(
+            questions_els,
+            page_questions,
+            test_attempt_url,
+            _get_stylesheets(tree, test_attempt_url),
+            tree.body,
+        ),
+        on_question,
+    )
+
+    return TestResultDTO(
+        info=TestInfoDTO(
+            id=test_url_info.test_id,
+            name=get_test_name(tree),
+            path='',
+            domain=test_url_info.domain,
+        ),
+        questions=questions,
+    )
@@ -0,0 +1,49 @@
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict
+
+import httpx
+
+from app.parser.constants import HEADERS
+from app.settings.config import settings
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client() -> httpx.AsyncClient:
+    # Клиент общий для всех пользователей домена, поэтому сессионные куки
+    # передаются в каждом запросе и никогда не сохраняются в клиенте
+    cookie_jar = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    return httpx.AsyncClient(
+        headers=HEADERS,
+        cookies=cookie_jar,
+        max_redirects=0,
+        http2=settings.MOODLE_HTTP2,
+        timeout=settings.MOODLE_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=settings.MOODLE_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.MOODLE_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+
+
+def get_moodle_client(domain: str) -> httpx.AsyncClient:
+    client = _clients.get(domain)
+    if client is None or client.is_closed:
+        client = _clients[domain] = _create_client()
+    return client
+
+
+def get_session_headers(cookie: str) -> Dict[str, str]:
+    return {'Cookie': f'MoodleSession={cookie}'}
+
+
+async def init_http_clients() -> None:
+    for domain in settings.MOODLE_DOMAINS:
+        get_moodle_client(domain)
+
+
+async def close_http_clients() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
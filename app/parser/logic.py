@@ -2,57 +2,72 @@ import logging
 import re
 from decimal import Decimal
 from functools import lru_cache
-from typing import Dict, List, Set
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Union
 from urllib.parse import parse_qsl
 
 import httpx
-from pyppeteer.browser import Browser
-from pyppeteer.element_handle import ElementHandle
+from pyppeteer.browser import Browser, BrowserContext
 from pyppeteer.page import Page
 from selectolax.parser import HTMLParser, Node
 
+from app.lib.progress import report_stage
+from app.lib.rate_limiter import RateLimitExceeded, rate_limited
 from app.lib.utils import decimal_quantize
+from app.parser.browser_pool import get_browser_context
 from app.parser.constants import (
-    FLAG_INPUT_SELECTOR, HEADERS, NOT_ANSWERED_CLASS,
-    QUESTIONS_SELECTOR,
+    FLAG_INPUT_SELECTOR, GRADE_SELECTOR, HEADERS, NOT_ANSWERED_CLASS,
+    QUESTIONS_EXTRACT_SCRIPT, QUESTIONS_SELECTOR,
 )
-from app.parser.dto import CompletionStatus, QuestionDTO, TestInfoDTO, TestResultDTO
-from app.parser.exceptions import AllQuestionsExists, ParseException
-from app.parser.helpers import (
-    get_element_property, get_headless_browser, get_test_info_from_attempt_url,
+from app.parser.dto import (
+    CompletionStatus, PageQuestionDTO, ParseStage, QuestionDTO, TestInfoDTO, TestResultDTO,
 )
+from app.parser.exceptions import AllQuestionsExists, ParseException
+from app.parser.helpers import get_test_info_from_attempt_url, is_question_status_improved
+from app.parser.http_client import get_moodle_client, get_session_headers
+from app.parser.screenshots import iter_questions_screenshots, take_questions_screenshots
+from app.settings.config import settings
 
 logger = logging.getLogger(__name__)
 
 MARK_REGEX = re.compile(r'(\d+(?:\.\d+))')
 
+QuestionConsumer = Callable[[QuestionDTO], Awaitable[None]]
+
 
 async def request_test_page(cookie: str, test_attempt_url: str) -> str:
-    cookies = {'MoodleSession': cookie}
-
-    async with httpx.AsyncClient(headers=HEADERS, cookies=cookies, max_redirects=0) as client:
-        try:
-            response = await client.get(test_attempt_url)
-            response.raise_for_status()
-        except httpx.RequestError as exc:
-            raise ParseException(f'Error while requesting : {exc.request.url!r}.')
-        except httpx.HTTPStatusError as exc:
-            raise ParseException(
-                f'Error response {exc.response.status_code} while requesting {exc.request.url!r}.',
-            )
-        else:
-            return response.text
+    test_url_info = get_test_info_from_attempt_url(test_attempt_url)
+    client = get_moodle_client(test_url_info.domain)
+
+    try:
+        async with rate_limited(test_url_info.domain) as outcome:
+            response = await client.get(test_attempt_url, headers=get_session_headers(cookie))
+            outcome.status_code = response.status_code
+        response.raise_for_status()
+    except RateLimitExceeded as exc:
+        raise ParseException(str(exc))
+    except httpx.RequestError as exc:
+        raise ParseException(f'Error while requesting : {exc.request.url!r}.')
+    except httpx.HTTPStatusError as exc:
+        raise ParseException(
+            f'Error response {exc.response.status_code} while requesting {exc.request.url!r}.',
+        )
+    else:
+        return response.text
 
 
-async def _get_question_completion_status(question_element: ElementHandle) -> CompletionStatus:
-    classes_str: str = await get_element_property(question_element, 'className')
-    classes = set(classes_str.split(' '))
+def get_completion_status(class_name: str, grade: Optional[str]) -> CompletionStatus:
+    classes = set(class_name.split(' '))
 
     if NOT_ANSWERED_CLASS in classes:
         return CompletionStatus.NOT_ANSWERED
 
-    mark_str = await question_element.querySelectorEval('div.grade', 'el => el.innerText')
-    return _get_completion_status_by_mark(mark_str)
+    if grade is None:
+        raise ParseException('Не найдена оценка за вопрос')
+    return _get_completion_status_by_mark(grade)
+
+
+def _get_question_completion_status(page_question: PageQuestionDTO) -> CompletionStatus:
+    return get_completion_status(page_question.class_name, page_question.grade)
 
 
 def _get_completion_status_by_mark(mark_str: str) -> CompletionStatus:
@@ -70,56 +85,116 @@ def _get_completion_status_by_mark(mark_str: str) -> CompletionStatus:
         return CompletionStatus.INCORRECT
 
 
-def _get_test_id_from_flag_input(flag_input_value: str) -> int:
+def get_question_id_from_flag_input(flag_input_value: str) -> int:
     question_id = dict(parse_qsl(flag_input_value))['qid']
     return int(question_id)
 
 
-async def _get_question_id_from_question_element(question_element: ElementHandle) -> int:
-    flag_input_value = await question_element.querySelectorEval(
-        selector=FLAG_INPUT_SELECTOR,
-        pageFunction='x => x.value',
+def _get_question_id(page_question: PageQuestionDTO) -> int:
+    if page_question.flag_value is None:
+        raise ParseException('Не найден идентификатор вопроса')
+    return get_question_id_from_flag_input(page_question.flag_value)
+
+
+async def _extract_page_questions(page: Page) -> List[PageQuestionDTO]:
+    payload = await page.evaluate(
+        QUESTIONS_EXTRACT_SCRIPT,
+        QUESTIONS_SELECTOR,
+        FLAG_INPUT_SELECTOR,
+        GRADE_SELECTOR,
     )
-    return _get_test_id_from_flag_input(flag_input_value)
+    return [PageQuestionDTO(**item) for item in payload]
 
 
 async def _parse_questions(
-    questions_elements: List[ElementHandle],
+    page: Page,
     questions_for_skip: Set[int],
-) -> List[QuestionDTO]:
-    questions: List[QuestionDTO] = []
-    for question_element in questions_elements:
-        question_id = await _get_question_id_from_question_element(question_element)
+) -> AsyncIterator[QuestionDTO]:
+    page_questions: Dict[int, PageQuestionDTO] = {}
+    for page_question in await _extract_page_questions(page):
+        question_id = _get_question_id(page_question)
 
         if question_id in questions_for_skip:
-            logger.debug('[%s] Question #%d already parsed, skipping')
+            logger.debug('Question #%d already parsed, skipping', question_id)
             continue
 
-        question_dto = QuestionDTO(
+        page_questions[question_id] = page_question
+
+    page_questions_items = iter(page_questions.items())
+    async for screenshot in iter_questions_screenshots(
+        page,
+        [page_question.box for page_question in page_questions.values()],
+    ):
+        question_id, page_question = next(page_questions_items)
+        yield QuestionDTO(
             id=question_id,
-            screenshot=await question_element.screenshot(),
-            status=await _get_question_completion_status(question_element),
+            screenshot=screenshot,
+            status=_get_question_completion_status(page_question),
+        )
+
+
+async def collect_questions(
+    questions: AsyncIterator[QuestionDTO],
+    on_question: Optional[QuestionConsumer],
+) -> List[QuestionDTO]:
+    """Передаёт вопросы потребителю по мере получения.
+
+    Если потребитель задан, вопросы не накапливаются и в результате их нет.
+    """
+    collected: List[QuestionDTO] = []
+    async for question_dto in questions:
+        if on_question is None:
+            collected.append(question_dto)
+        else:
+            await on_question(question_dto)
+    return collected
+
+
+def get_page_questions_statuses(tree: HTMLParser) -> Dict[int, CompletionStatus]:
+    page_questions: Dict[int, CompletionStatus] = {}
+    for question_el in tree.css(QUESTIONS_SELECTOR):  # type: Node
+        flag_input = question_el.css_first(FLAG_INPUT_SELECTOR)
+        if flag_input is None or not flag_input.attributes.get('value'):
+            raise ParseException('Не найден идентификатор вопроса')
+
+        grade_el = question_el.css_first(GRADE_SELECTOR)
+        question_id = get_question_id_from_flag_input(flag_input.attributes['value'])
+        page_questions[question_id] = get_completion_status(
+            question_el.attributes.get('class') or '',
+            grade_el.text(deep=True) if grade_el is not None else None,
         )
-        questions.append(question_dto)
 
-    return questions
+    return page_questions
+
+
+def get_test_name(tree: HTMLParser) -> str:
+    navbar_item = tree.css_first('#page-navbar li:last-child')
+    if navbar_item is None:
+        raise ParseException('Не найдено название теста')
+    return navbar_item.text(deep=True).strip()
 
 
 def get_test_questions_for_skip(
-    test_page: str,
-    existing_test_questions: List[int],
+    page_questions: Dict[int, CompletionStatus],
+    existing_questions: Dict[int, CompletionStatus],
 ) -> Set[int]:
-    tree = HTMLParser(test_page)
+    return {
+        question_id
+        for question_id, status in page_questions.items()
+        if question_id in existing_questions
+        and not is_question_status_improved(existing_questions[question_id], status)
+    }
 
-    page_questions: List[int] = []
-    for question_el in tree.css(QUESTIONS_SELECTOR):  # type: Node
-        flag_input_value = question_el.css_first(FLAG_INPUT_SELECTOR).attributes['value']
-        page_questions.append(_get_test_id_from_flag_input(flag_input_value))
 
-    existing_test_questions_set = set(existing_test_questions)
-    page_questions_set = set(page_questions)
+def get_questions_for_skip_or_raise(
+    page_questions: Dict[int, CompletionStatus],
+    existing_questions: Dict[int, CompletionStatus],
+) -> Set[int]:
+    questions_for_skip = get_test_questions_for_skip(page_questions, existing_questions)
+    if page_questions and len(questions_for_skip) == len(page_questions):
+        raise AllQuestionsExists()
 
-    return existing_test_questions_set.intersection(page_questions_set)
+    return questions_for_skip
 
 
 @lru_cache
@@ -132,14 +207,23 @@ def _get_session_cookie(cookie: str, domain: str) -> Dict[str, str]:
 
 
 async def _navigate_to_test_page(
-    browser: Browser,
+    browser: Union[Browser, BrowserContext],
     attempt_url: str,
     session_cookie: Dict[str, str],
 ) -> Page:
     page: Page = await browser.newPage()
     await page.setUserAgent(HEADERS['User-Agent'])
     await page.setCookie(session_cookie)
-    await page.goto(attempt_url, {'waitUntil': 'networkidle2'})
+
+    try:
+        async with rate_limited(
+            session_cookie['domain'],
+            latency_threshold=settings.RATE_LIMIT_BROWSER_LATENCY_THRESHOLD,
+        ) as outcome:
+            response = await page.goto(attempt_url, {'waitUntil': 'networkidle2'})
+            outcome.status_code = response.status if response else None
+    except RateLimitExceeded as exc:
+        raise ParseException(str(exc))
 
     return page
 
@@ -156,19 +240,19 @@ async def _get_info_from_navbar(page: Page) -> str:
 async def parse_test(
     cookie: str,
     test_attempt_url: str,
-    existing_test_questions: List[int],
+    existing_questions: Dict[int, CompletionStatus],
+    on_question: Optional[QuestionConsumer] = None,
+    test_page: Optional[str] = None,
 ) -> TestResultDTO:
     test_url_info = get_test_info_from_attempt_url(test_attempt_url)
-    test_page = await request_test_page(cookie, test_attempt_url)
+    if test_page is None:
+        test_page = await request_test_page(cookie, test_attempt_url)
 
-    if existing_test_questions:
-        questions_for_skip = get_test_questions_for_skip(test_page, existing_test_questions)
-        if len(questions_for_skip) == len(existing_test_questions):
-            raise AllQuestionsExists()
-    else:
-        questions_for_skip = set()
+    # Браузер запускается, только если хотя бы один вопрос изменит статус
+    page_questions = get_page_questions_statuses(HTMLParser(test_page))
+    questions_for_skip = get_questions_for_skip_or_raise(page_questions, existing_questions)
 
-    async with get_headless_browser() as browser:
+    async with get_browser_context() as browser:
         session_cookie = _get_session_cookie(cookie, test_url_info.domain)
         page = await _navigate_to_test_page(browser, test_attempt_url, session_cookie)
 
@@ -179,10 +263,25 @@ async def parse_test(
             domain=test_url_info.domain,
         )
 
-        questions_elements = await page.querySelectorAll(QUESTIONS_SELECTOR)
-        questions = await _parse_questions(questions_elements, questions_for_skip)
+        await report_stage(ParseStage.RENDERING, total=len(page_questions) - len(questions_for_skip))
+        questions = await collect_questions(_parse_questions(page, questions_for_skip), on_question)
 
     return TestResultDTO(
         info=test_info,
         questions=questions,
     )
+
+
+async def render_question_screenshot(document_url: str) -> bytes:
+    async with get_browser_context() as browser:
+        page: Page = await browser.newPage()
+        await page.setUserAgent(HEADERS['User-Agent'])
+        await page.goto(document_url, {'waitUntil': 'networkidle0'})
+
+        page_questions = await _extract_page_questions(page)
+        if not page_questions:
+            raise ParseException('Вопрос не найден в сохранённом документе')
+
+        screenshots = await take_questions_screenshots(page, [page_questions[0].box])
+
+    return screenshots[0]
@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops
+
+from app.parser.dto import PostprocessOptionsDTO, ScreenshotFormat
+from app.settings.config import settings
+
+_postprocess_executor: Optional[Executor] = None
+
+
+def _get_postprocess_executor() -> Executor:
+    global _postprocess_executor
+
+    if _postprocess_executor is None:
+        if multiprocessing.current_process().daemon:
+            # Процессы-демоны не могут порождать дочерние процессы
+            _postprocess_executor = ThreadPoolExecutor(
+                max_workers=settings.SCREENSHOT_POSTPROCESS_WORKERS,
+                thread_name_prefix='screenshot-postprocess',
+            )
+        else:
+            # fork копировал бы поток event loop, пулы соединений и браузер воркера,
+            # spawn запускает чистый интерпретатор
+            _postprocess_executor = ProcessPoolExecutor(
+                max_workers=settings.SCREENSHOT_POSTPROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _postprocess_executor
+
+
+def _get_postprocess_options() -> PostprocessOptionsDTO:
+    return PostprocessOptionsDTO(
+        trim=settings.SCREENSHOT_TRIM,
+        trim_padding=settings.SCREENSHOT_TRIM_PADDING,
+        max_width=settings.SCREENSHOT_MAX_WIDTH,
+        encoding=settings.SCREENSHOT_ENCODING,
+        png_quantize=settings.SCREENSHOT_PNG_QUANTIZE,
+        png_colors=settings.SCREENSHOT_PNG_COLORS,
+        webp_quality=settings.SCREENSHOT_WEBP_QUALITY,
+        webp_lossless=settings.SCREENSHOT_WEBP_LOSSLESS,
+    )
+
+
+def _trim_background(image: Image.Image, padding: int) -> Image.Image:
+    # Фоном считается цвет левого верхнего пикселя
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    bbox = ImageChops.difference(image, background).getbbox()
+    if bbox is None:
+        return image
+
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(left - padding, 0),
+        max(top - padding, 0),
+        min(right + padding, image.width),
+        min(bottom + padding, image.height),
+    ))
+
+
+def _downscale(image: Image.Image, max_width: int) -> Image.Image:
+    if image.width <= max_width:
+        return image
+    height = max(round(image.height * max_width / image.width), 1)
+    return image.resize((max_width, height), Image.LANCZOS)
+
+
+def process_screenshot(screenshot: bytes, options: PostprocessOptionsDTO) -> Tuple[bytes, ScreenshotFormat]:
+    with Image.open(BytesIO(screenshot)) as source:
+        image = source.convert('RGB')
+
+    if options.trim:
+        image = _trim_background(image, options.trim_padding)
+    if options.max_width:
+        image = _downscale(image, options.max_width)
+
+    output = BytesIO()
+    if options.encoding == 'webp':
+        image.save(
+            output,
+            format='WEBP',
+            quality=options.webp_quality,
+            lossless=options.webp_lossless,
+            method=4,
+        )
+        return output.getvalue(), ScreenshotFormat.WEBP
+
+    if options.png_quantize:
+        image = image.quantize(colors=options.png_colors, method=Image.FASTOCTREE)
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue(), ScreenshotFormat.PNG
+
+
+async def postprocess_screenshot(
+    screenshot: bytes,
+    screenshot_format: ScreenshotFormat,
+) -> Tuple[bytes, ScreenshotFormat]:
+    """Обрезает поля, уменьшает и пережимает скриншот вне event loop.
+
+    HTML-документы и скриншоты при выключенной обработке возвращаются как есть.
+    """
+    if not settings.SCREENSHOT_POSTPROCESS or screenshot_format != ScreenshotFormat.PNG:
+        return screenshot, screenshot_format
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        _get_postprocess_executor(),
+        process_screenshot,
+        screenshot,
+        _get_postprocess_options(),
+    )
@@ -0,0 +1,84 @@
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import AsyncIterator, List, Optional
+
+from PIL import Image
+from pyppeteer.page import Page
+
+from app.parser.dto import BoundingBoxDTO
+from app.settings.config import settings
+
+_crop_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_crop_executor() -> ThreadPoolExecutor:
+    global _crop_executor
+
+    if _crop_executor is None:
+        _crop_executor = ThreadPoolExecutor(
+            max_workers=settings.SCREENSHOT_CROP_WORKERS,
+            thread_name_prefix='screenshot-crop',
+        )
+    return _crop_executor
+
+
+def _decode_image(image_bytes: bytes) -> Image.Image:
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+    return image
+
+
+def _get_union_clip(boxes: List[BoundingBoxDTO]) -> BoundingBoxDTO:
+    left = max(math.floor(min(box.x for box in boxes)), 0)
+    top = max(math.floor(min(box.y for box in boxes)), 0)
+    right = math.ceil(max(box.x + box.width for box in boxes))
+    bottom = math.ceil(max(box.y + box.height for box in boxes))
+    return BoundingBoxDTO(x=left, y=top, width=right - left, height=bottom - top)
+
+
+def _crop_image(image: Image.Image, box: BoundingBoxDTO, offset: BoundingBoxDTO) -> bytes:
+    crop_box = (
+        max(math.floor(box.x - offset.x), 0),
+        max(math.floor(box.y - offset.y), 0),
+        min(math.ceil(box.x - offset.x + box.width), image.width),
+        min(math.ceil(box.y - offset.y + box.height), image.height),
+    )
+    output = BytesIO()
+    image.crop(crop_box).save(output, format='PNG')
+    return output.getvalue()
+
+
+async def iter_element_screenshots(page: Page, boxes: List[BoundingBoxDTO]) -> AsyncIterator[bytes]:
+    for box in boxes:
+        yield await page.screenshot({'clip': box.dict()})
+
+
+async def iter_cropped_screenshots(page: Page, boxes: List[BoundingBoxDTO]) -> AsyncIterator[bytes]:
+    if not boxes:
+        return
+
+    loop = asyncio.get_event_loop()
+    executor = _get_crop_executor()
+
+    # Снимаем один раз только область вьюпорта, покрывающую все вопросы
+    clip = _get_union_clip(boxes)
+    page_screenshot = await page.screenshot({'clip': clip.dict()})
+    image = await loop.run_in_executor(executor, _decode_image, page_screenshot)
+    try:
+        # Вырезаем по одному, чтобы в памяти не копились закодированные скриншоты всех вопросов
+        for box in boxes:
+            yield await loop.run_in_executor(executor, _crop_image, image, box, clip)
+    finally:
+        image.close()
+
+
+def iter_questions_screenshots(page: Page, boxes: List[BoundingBoxDTO]) -> AsyncIterator[bytes]:
+    if settings.SCREENSHOT_MODE == 'full_page':
+        return iter_cropped_screenshots(page, boxes)
+    return iter_element_screenshots(page, boxes)
+
+
+async def take_questions_screenshots(page: Page, boxes: List[BoundingBoxDTO]) -> List[bytes]:
+    return [screenshot async for screenshot in iter_questions_screenshots(page, boxes)]
@@ -1,16 +1,37 @@
+from kombu import Queue
+
+from app.core.serialization import SERIALIZER_NAME, register_serializer
 from app.settings.config import settings
 
+register_serializer()
+
 REDIS_HOST = settings.REDIS_HOST
 REDIS_PORT = settings.REDIS_PORT
 REDIS_PASSWORD = settings.REDIS_PASSWORD or ''
 
 broker_url = f'redis://{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/0'
-accept_content = ['pickle']
+# pickle принимается ещё один релиз, чтобы воркеры дочитали задачи, поставленные до перехода на msgpack
+accept_content = [SERIALIZER_NAME, 'pickle']
 enable_utc = True
 task_acks_late = True
-task_serializer = 'pickle'
+task_serializer = SERIALIZER_NAME
 timezone = 'UTC'
 task_track_started = False
 worker_hijack_root_logger = False
 # worker_redirect_stdouts_level = 'ERROR'
 result_expires = 60 * 60 * 24
+
+task_queues = (
+    Queue('parse.new'),
+    Queue('parse.partial'),
+    Queue('parse.known'),
+    Queue('celery'),
+)
+task_default_queue = 'celery'
+# Воркер, слушающий несколько очередей, выбирает задачи в порядке task_queues
+broker_transport_options = {'queue_order_strategy': 'priority'}
+
+if settings.CELERY_ASYNC_EXECUTION:
+    # Потоки только ждут результата корутин в общем event loop процесса
+    worker_pool = 'threads'
+    worker_concurrency = settings.CELERY_ASYNC_MAX_IN_FLIGHT
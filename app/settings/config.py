@@ -1,6 +1,6 @@
 import secrets
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, List, Literal, Optional, Union
 
 from pydantic import AnyHttpUrl, BaseSettings, HttpUrl, validator
 
@@ -38,13 +38,88 @@ class Settings(BaseSettings):
     REDIS_HOST: str = 'localhost'
     REDIS_PORT: int = 6379
     REDIS_PASSWORD: Optional[str] = None
+    REDIS_POOL_MIN_SIZE: int = 1
+    REDIS_POOL_MAX_SIZE: int = 20
+    REDIS_POOL_TIMEOUT: float = 5.0
+    REDIS_CONNECT_TIMEOUT: float = 5.0
+    REDIS_SOCKET_TIMEOUT: float = 5.0
+    REDIS_HEALTH_CHECK_INTERVAL: int = 30
+    LOCK_TTL: float = 30.0
+
+    CELERY_ASYNC_EXECUTION: bool = False
+    CELERY_ASYNC_MAX_IN_FLIGHT: int = 32
+    # Окно объединения запросов разбора одного теста, 0 отключает объединение
+    PARSE_COALESCE_WINDOW: int = 5
+    CELERY_WORKER_QUEUE: Optional[str] = None
+    PARSE_QUEUES_CONCURRENCY: Dict[str, int] = {
+        'parse.new': 8,
+        'parse.partial': 4,
+        'parse.known': 2,
+    }
+
+    PARSE_BATCH_MAX_SIZE: int = 500
+    JOB_PROGRESS_TTL: int = 60 * 60 * 24
+    JOB_PROGRESS_MIN_INTERVAL: float = 1.0
+    JOB_POLL_INTERVAL: float = 0.5
+    JOB_LONG_POLL_TIMEOUT: float = 30.0
+    JOB_EVENTS_TIMEOUT: float = 300.0
+
+    SEARCH_BULK_MAX_SIZE: int = 100
+    QUESTIONS_LOOKUP_MAX_SIZE: int = 200
+    SEARCH_CACHE_TTL: int = 10 * 60
+    LOCAL_CACHE_SIZE: int = 1024
+    LOCAL_CACHE_TTL: int = 60
+    QUESTIONS_MISS_CACHE_TTL: int = 5
 
     AWS_ACCESS_KEY_ID: str
     AWS_SECRET_ACCESS_KEY: str
     AWS_S3_ENDPOINT_URL: HttpUrl
     AWS_S3_REGION_NAME: str
+    S3_QUESTIONS_BUCKET: str = 'questions'
+    S3_UPLOAD_CONCURRENCY: int = 8
+    S3_MAX_POOL_CONNECTIONS: int = 32
+    S3_KEEPALIVE_TIMEOUT: float = 60.0
+
+    MOODLE_DOMAINS: List[str] = []
+    MOODLE_HTTP2: bool = False
+    MOODLE_TIMEOUT: float = 10.0
+    MOODLE_MAX_CONNECTIONS: int = 20
+    MOODLE_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    RATE_LIMIT_INITIAL_RATE: float = 5.0
+    RATE_LIMIT_MIN_RATE: float = 0.5
+    RATE_LIMIT_MAX_RATE: float = 50.0
+    RATE_LIMIT_BURST: int = 10
+    RATE_LIMIT_INCREASE: float = 0.2
+    RATE_LIMIT_DECREASE_FACTOR: float = 0.5
+    RATE_LIMIT_DECREASE_COOLDOWN: float = 5.0
+    RATE_LIMIT_LATENCY_THRESHOLD: float = 3.0
+    RATE_LIMIT_BROWSER_LATENCY_THRESHOLD: float = 15.0
+    RATE_LIMIT_MAX_WAIT: float = 30.0
+
+    PARSER_BACKEND: Literal['browser', 'html'] = 'browser'
+    HTML_IMAGES_CONCURRENCY: int = 8
 
     CHROMIUM_PATH: str
+    BROWSER_POOL_SIZE: int = 1
+    BROWSER_POOL_MAX_CONTEXTS: int = 4
+    BROWSER_MAX_PAGES: int = 100
+    BROWSER_MAX_MEMORY_MB: int = 1024
+    BROWSER_HEALTH_CHECK_TIMEOUT: float = 5.0
+
+    SCREENSHOT_MODE: Literal['element', 'full_page'] = 'full_page'
+    SCREENSHOT_PIPELINE_QUEUE_SIZE: int = 4
+    SCREENSHOT_CROP_WORKERS: int = 4
+    SCREENSHOT_POSTPROCESS: bool = True
+    SCREENSHOT_POSTPROCESS_WORKERS: int = 2
+    SCREENSHOT_TRIM: bool = True
+    SCREENSHOT_TRIM_PADDING: int = 8
+    SCREENSHOT_MAX_WIDTH: Optional[int] = None
+    SCREENSHOT_ENCODING: Literal['png', 'webp'] = 'png'
+    # Квантование до палитры теряет цвета сглаживания, поэтому включается явно
+    SCREENSHOT_PNG_QUANTIZE: bool = False
+    SCREENSHOT_PNG_COLORS: int = 256
+    SCREENSHOT_WEBP_QUALITY: int = 80
+    SCREENSHOT_WEBP_LOSSLESS: bool = False
 
     CORS_ORIGINS: List[AnyHttpUrl] = [
         'http://localhost',